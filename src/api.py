@@ -1,10 +1,53 @@
 """MAAS Site Manager API client."""
 
+import asyncio
+import base64
+import bisect
+import contextlib
+import enum
+import functools
+import itertools
+import json
 import logging
+import re
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+from urllib.parse import urlencode, urlparse
 
 import requests
+from opentelemetry import trace
+from opentelemetry.trace import Span, StatusCode
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_CODES = (502, 503, 504)
+RETRY_METHODS = frozenset({"get", "head", "put", "delete", "options"})
+# refresh access tokens this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 60
+ENROLL_TOKEN_DURATION = 3600
+PAGE_SIZE = 100
+DEFAULT_DELETE_PARALLELISM = 4
+DEFAULT_TIMEOUT = (3.05, 10.0)  # connect, read
+CACHE_MAX_ENTRIES = 50
+CACHE_MAX_AGE = 24 * 3600.0
+# only listings queried with these parameters alone are cached
+CACHE_PARAMS = frozenset({"page", "size"})
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 120.0
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# path segments identifying a single resource, collapsed when naming endpoints
+RESOURCE_ID_SEGMENT = re.compile(r"/(\d+|[0-9a-fA-F-]{36})(?=/|$)")
 
 
 class AuthError(Exception):
@@ -15,27 +58,534 @@ class ApiError(Exception):
     """API client error."""
 
 
+def jwt_expiry(token: str) -> float | None:
+    """Return the expiry timestamp of a JWT.
+
+    The signature is not verified, the claim is only used to decide
+    whether a cached token is still worth sending.
+
+    Args:
+        token (str): encoded JWT
+
+    Returns:
+        float | None: the `exp` claim, or None if it cannot be decoded
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class DeadlineExceededError(ApiError):
+    """The time budget for API calls is exhausted."""
+
+
+class CircuitOpenError(ApiError):
+    """The API keeps failing, requests are not attempted."""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated API failures.
+
+    After `threshold` consecutive failures the circuit opens and requests
+    are refused until `reset_timeout` seconds have passed. Then the circuit
+    is half-open: a single trial request is let through while the others
+    are still refused. The circuit closes again if the trial succeeds and
+    reopens if it fails. A trial with no outcome after `reset_timeout`
+    seconds is given up and another one is allowed.
+    The state can be persisted across hooks with `state` and `on_change`.
+    The circuit may be shared by several threads, see `deferred_changes`.
+    """
+
+    def __init__(
+        self,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+        state: dict[str, Any] | None = None,
+        on_change: Callable[[dict[str, Any]], None] | None = None,
+    ) -> None:
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = int((state or {}).get("failures", 0))
+        self._opened_at = (state or {}).get("opened_at")
+        self._trial_at: float | None = None
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._deferred = False
+        self._changes_pending = False
+
+    @property
+    def state(self) -> dict[str, Any]:
+        """Serializable state of the circuit."""
+        return {"failures": self._failures, "opened_at": self._opened_at}
+
+    def allow(self) -> bool:
+        """Whether a request may be attempted.
+
+        While the circuit is half-open, only the first caller gets through.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.time()
+            if now - self._opened_at < self._reset_timeout:
+                return False
+            if self._trial_at is not None and now - self._trial_at < self._reset_timeout:
+                return False
+            self._trial_at = now
+            return True
+
+    def record_success(self) -> None:
+        """Close the circuit after a successful request."""
+        with self._lock:
+            self._trial_at = None
+            if self._failures or self._opened_at is not None:
+                self._failures = 0
+                self._opened_at = None
+                self._changed()
+
+    def record_failure(self) -> None:
+        """Count a failed request, opening the circuit past the threshold."""
+        with self._lock:
+            self._trial_at = None
+            self._failures += 1
+            if self._failures >= self._threshold:
+                if self._opened_at is None:
+                    logger.warning("API failed %d times in a row, opening circuit", self._failures)
+                self._opened_at = time.time()
+            self._changed()
+
+    @contextlib.contextmanager
+    def deferred_changes(self) -> Iterator[None]:
+        """Hold back `on_change` calls while worker threads use the circuit.
+
+        The final state is reported once on exit, from the calling thread.
+        """
+        self._deferred = True
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._deferred = False
+                if self._changes_pending:
+                    self._changed()
+
+    def _changed(self) -> None:
+        if self._deferred:
+            self._changes_pending = True
+            return
+        self._changes_pending = False
+        if self._on_change:
+            self._on_change(self.state)
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """Name the API endpoint targeted by a request, e.g. `DELETE /api/v1/sites/{id}`."""
+    return f"{method.upper()} {RESOURCE_ID_SEGMENT.sub('/{id}', urlparse(url).path)}"
+
+
+class ApiStats:
+    """Per-endpoint request statistics.
+
+    For each endpoint this keeps the number of requests, failed requests
+    and response bytes, the total time spent, and a latency histogram
+    whose buckets are bounded by `LATENCY_BUCKETS`, plus a final bucket
+    for slower requests. The data is JSON-serializable.
+    """
+
+    def __init__(self, data: dict[str, Any] | None = None) -> None:
+        self.data: dict[str, Any] = data or {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, duration: float, status: int | None, size: int) -> None:
+        """Record a request.
+
+        Args:
+            endpoint (str): endpoint name
+            duration (float): request duration, in seconds
+            status (int | None): response status, None if no response was received
+            size (int): response size, in bytes
+        """
+        with self._lock:
+            entry = self.data.setdefault(
+                endpoint,
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "bytes": 0,
+                    "seconds": 0.0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                },
+            )
+            entry["count"] += 1
+            entry["errors"] += int(status is None or status >= 400)
+            entry["bytes"] += size
+            entry["seconds"] += duration
+            entry["buckets"][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+
+class ResponseCache:
+    """Cache of JSON responses, revalidated with ETag or Last-Modified.
+
+    Entries are keyed by URL and query parameters. Only responses carrying
+    a validator are stored, so servers that send neither are unaffected.
+    Filtered listings are not cached, as each filter value would need its
+    own entry. Entries expire after `max_age` seconds, and the oldest ones
+    are evicted beyond `max_entries`. The data is JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        data: dict[str, Any] | None = None,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_age: float = CACHE_MAX_AGE,
+    ) -> None:
+        self.data: dict[str, Any] = data or {}
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(url: str, params: dict[str, Any]) -> str:
+        return f"{url}?{urlencode(sorted(params.items()))}"
+
+    def get(self, url: str, params: dict[str, Any]) -> dict[str, Any] | None:
+        """Return the cached entry with its validators, if any."""
+        with self._lock:
+            entry = self.data.get(self._key(url, params))
+            if entry and time.time() - entry.get("stored_at", 0) < self._max_age:
+                return entry
+            return None
+
+    def put(self, url: str, params: dict[str, Any], resp: requests.Response) -> None:
+        """Store a response if it can be revalidated later."""
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if not (etag or last_modified) or set(params) - CACHE_PARAMS:
+            return
+        entry = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": resp.json(),
+            "stored_at": time.time(),
+        }
+        with self._lock:
+            self.data.pop(self._key(url, params), None)
+            self.data[self._key(url, params)] = entry
+            # entries are kept in insertion order, oldest first
+            for key in list(self.data)[: max(len(self.data) - self._max_entries, 0)]:
+                del self.data[key]
+
+    @staticmethod
+    def conditional_headers(entry: dict[str, Any]) -> dict[str, str]:
+        """Request headers revalidating a cached entry."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+class SiteRemoval(str, enum.Enum):
+    """Outcome of removing a single site."""
+
+    REMOVED = "removed"
+    NOT_FOUND = "not-found"
+    FAILED = "failed"
+
+
 class SiteManagerClient:
     """Site Manager API client."""
 
-    def __init__(self, username: str, password: str, url: str) -> None:
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        url: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        retries: int = DEFAULT_RETRIES,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        access_token: str | None = None,
+        on_login: Callable[[str], None] | None = None,
+        timeout: tuple[float, float] = DEFAULT_TIMEOUT,
+        deadline: float | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        stats: ApiStats | None = None,
+        cache: ResponseCache | None = None,
+    ) -> None:
         self._username = username
         self._password = password
         self._url = url
+        self._access_token = access_token
+        self._on_login = on_login
+        self._timeout = timeout
+        self._deadline = deadline
+        self._circuit_breaker = circuit_breaker
+        self._stats = stats
+        self._cache = cache
+        self._pool_size = pool_size
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        self._login_lock = threading.Lock()
+        self._login_deferred = False
+        self._login_pending = False
+        # set once the server is seen listing pending sites of other clusters
+        self._pending_filter_ignored = False
+        self._session = self._create_session(pool_size)
+
+    @property
+    def pool_size(self) -> int:
+        """Maximum number of pooled connections per host."""
+        return self._pool_size
+
+    def __enter__(self) -> "SiteManagerClient":
+        """Enter the client context."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Close the client session on context exit."""
+        self.close()
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """Create a keep-alive HTTP session backed by a connection pool.
+
+        Retries are handled by `_send`, so that they count against the deadline.
+        """
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self) -> None:
+        """Release the pooled connections."""
+        self._session.close()
+
+    @property
+    def access_token(self) -> str | None:
+        """The access token currently used by the client."""
+        return self._access_token
+
+    def _request_timeout(self) -> tuple[float, float]:
+        """Connect and read timeouts, capped by the remaining deadline budget.
+
+        Raises:
+            DeadlineExceededError: the deadline has passed
+        """
+        if self._deadline is None:
+            return self._timeout
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("Deadline for API calls exceeded")
+        connect, read = self._timeout
+        return min(connect, remaining), min(read, remaining)
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request with timeouts and retries.
+
+        Idempotent requests are retried with exponential backoff on connection
+        errors and on transient gateway errors. The circuit breaker and the
+        deadline are checked before each attempt, and no retry is made if the
+        backoff would overrun the deadline.
+
+        Raises:
+            CircuitOpenError: the circuit breaker refused the request
+            DeadlineExceededError: the deadline has passed
+        """
+        attempt = 0
+        while True:
+            try:
+                resp = self._attempt(method, url, **kwargs)
+            except requests.RequestException:
+                if (delay := self._retry_delay(method, attempt)) is None:
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUS_CODES:
+                    return resp
+                if (delay := self._retry_delay(method, attempt)) is None:
+                    return resp
+            attempt += 1
+            logger.debug("retrying %s %s in %.2fs", method.upper(), url, delay)
+            time.sleep(delay)
+
+    def _retry_delay(self, method: str, attempt: int) -> float | None:
+        """Backoff before retrying a failed attempt, None if it is not retried."""
+        if method not in RETRY_METHODS or attempt >= self._retries:
+            return None
+        delay = self._backoff_factor * 2**attempt
+        if self._deadline is not None and time.monotonic() + delay >= self._deadline:
+            return None
+        return delay
+
+    def _attempt(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a single request with timeouts, in a tracing span.
+
+        Raises:
+            CircuitOpenError: the circuit breaker refused the request
+            DeadlineExceededError: the deadline has passed
+        """
+        # checked first, so that a missed deadline does not use up a trial request
+        timeout = self._request_timeout()
+        if self._circuit_breaker and not self._circuit_breaker.allow():
+            raise CircuitOpenError(f"Too many failed API calls, not sending {method} {url}")
+        endpoint = endpoint_name(method, url)
+        with tracer.start_as_current_span(f"msm-api {endpoint}") as span:
+            span.set_attribute("http.request.method", method.upper())
+            span.set_attribute("url.full", url)
+            start = time.monotonic()
+            try:
+                resp = getattr(self._session, method)(url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                span.record_exception(e)
+                self._record(span, endpoint, time.monotonic() - start, None)
+                raise
+            self._record(span, endpoint, time.monotonic() - start, resp)
+        return resp
+
+    def _record(
+        self, span: Span, endpoint: str, duration: float, resp: requests.Response | None
+    ) -> None:
+        """Record the outcome of a request in its span, the statistics and the circuit breaker."""
+        status = resp.status_code if resp is not None else None
+        size = len(resp.content) if resp is not None else 0
+        span.set_attribute("http.response.body.size", size)
+        span.set_attribute("msm.api.duration_ms", duration * 1000)
+        if status is not None:
+            span.set_attribute("http.response.status_code", status)
+        if self._stats:
+            self._stats.record(endpoint, duration, status, size)
+
+        failed = status is None or status >= 500
+        if failed:
+            span.set_status(StatusCode.ERROR)
+        if self._circuit_breaker:
+            if failed:
+                self._circuit_breaker.record_failure()
+            else:
+                self._circuit_breaker.record_success()
+
+    def _token_is_valid(self) -> bool:
+        """Whether the cached access token can still be used."""
+        if not self._access_token:
+            return False
+        expiry = jwt_expiry(self._access_token)
+        return expiry is not None and expiry - TOKEN_EXPIRY_MARGIN > time.time()
 
     def _login(self) -> dict[str, str]:
-        """Authenticate client."""
-        resp = requests.post(
-            f"{self._url}/api/v1/login",
-            data={
-                "username": self._username,
-                "password": self._password,
-            },
+        """Authenticate client, reusing the cached access token until it expires.
+
+        Threads sharing the client wait for a single login.
+        """
+        with self._login_lock:
+            if not self._token_is_valid():
+                resp = self._send(
+                    "post",
+                    f"{self._url}/api/v1/login",
+                    data={
+                        "username": self._username,
+                        "password": self._password,
+                    },
+                )
+                if not resp.ok:
+                    raise AuthError(f"Failed to authenticate: {resp.text}")
+                self._access_token = resp.json().get("access_token")
+                if self._access_token:
+                    self._logged_in()
+            return {"Authorization": f"Bearer {self._access_token}"}
+
+    def login(self) -> dict[str, str]:
+        """Authenticate client, reusing the cached access token until it expires.
+
+        Raises:
+            AuthError: the credentials were rejected
+
+        Returns:
+            dict[str, str]: authorization headers
+        """
+        return self._login()
+
+    def _logged_in(self) -> None:
+        if self._login_deferred:
+            self._login_pending = True
+        elif self._on_login and self._access_token:
+            self._login_pending = False
+            self._on_login(self._access_token)
+
+    @contextlib.contextmanager
+    def deferred_callbacks(self) -> Iterator[None]:
+        """Hold back the `on_login` and circuit breaker callbacks while threads use the client.
+
+        The callbacks usually update charm state, which may only be done from
+        the hook thread. They run once on exit, from the calling thread.
+        """
+        breaker = (
+            self._circuit_breaker.deferred_changes()
+            if self._circuit_breaker
+            else contextlib.nullcontext()
         )
+        self._login_deferred = True
+        try:
+            with breaker:
+                yield
+        finally:
+            with self._login_lock:
+                self._login_deferred = False
+                if self._login_pending:
+                    self._logged_in()
+
+    def _request(
+        self, method: str, path: str, headers: dict[str, str] | None = None, **kwargs
+    ) -> requests.Response:
+        """Perform an authenticated request.
+
+        If the server rejects the access token, e.g. because it was revoked
+        or has expired early, log in again and retry once.
+        """
+
+        def send(auth: dict[str, str]) -> requests.Response:
+            return self._send(
+                method,
+                f"{self._url}{path}",
+                headers={**auth, **headers} if headers else auth,
+                **kwargs,
+            )
+
+        auth = self._login()
+        resp = send(auth)
+        if resp.status_code == 401:
+            logger.info("access token rejected, logging in again")
+            with self._login_lock:
+                # another thread may have logged in again already
+                if auth == {"Authorization": f"Bearer {self._access_token}"}:
+                    self._access_token = None
+            resp = send(self._login())
+        return resp
+
+    def _get_json(self, path: str, params: dict[str, Any]) -> Any:
+        """Fetch a JSON document, revalidating the cached copy if there is one.
+
+        Raises:
+            ApiError: API failed to comply with request
+        """
+        url = f"{self._url}{path}"
+        cached = self._cache.get(url, params) if self._cache else None
+        resp = self._request(
+            "get",
+            path,
+            headers=ResponseCache.conditional_headers(cached) if cached else None,
+            params=params,
+        )
+        if cached and resp.status_code == 304:
+            return cached["body"]
         if not resp.ok:
-            raise AuthError(f"Failed to authenticate: {resp.text}")
-        jwt = resp.json().get("access_token")
-        return {"Authorization": f"Bearer {jwt}"}
+            raise ApiError(f"Failed to query {path}: {resp.text}")
+        if self._cache:
+            self._cache.put(url, params, resp)
+        return resp.json()
 
     def issue_enroll_token(self) -> str:
         """Issue an enrollment token.
@@ -46,74 +596,353 @@ class SiteManagerClient:
         Returns:
             str: encoded JWT enrollment token
         """
-        headers = self._login()
+        return self.issue_enroll_tokens(count=1)[0][0]
+
+    def issue_enroll_tokens(
+        self, count: int, duration: int = ENROLL_TOKEN_DURATION
+    ) -> list[tuple[str, float]]:
+        """Issue a batch of enrollment tokens in a single request.
 
-        resp = requests.post(
-            f"{self._url}/api/v1/tokens",
+        Args:
+            count (int): number of tokens to issue
+            duration (int): validity of the tokens, in seconds
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            list[tuple[str, float]]: encoded JWT enrollment tokens and their expiry timestamp
+        """
+        issued_at = time.time()
+        resp = self._request(
+            "post",
+            "/api/v1/tokens",
             json={
-                "count": 1,
-                "duration": 3600,
+                "count": count,
+                "duration": duration,
             },
-            headers=headers,  # type: ignore
         )
         if not resp.ok:
             raise ApiError(f"Failed to issue enrollment token: {resp.text}")
 
-        tokens = resp.json().get("items")
-        return tokens[0]["value"]
+        return [
+            (token["value"], jwt_expiry(token["value"]) or issued_at + duration)
+            for token in resp.json().get("items")
+        ]
 
-    def remove_site(self, cluster_id: str) -> None:
-        """Remove a MAAS Site from MAAS Site Manager.
+    def iter_pages(
+        self,
+        path: str,
+        params: dict[str, Any] | None = None,
+        page_size: int = PAGE_SIZE,
+        first: dict[str, Any] | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """Iterate over the pages of a paginated list endpoint.
+
+        Pages are requested lazily, so a caller that stops iterating early
+        does not download the rest of the listing.
+
+        Args:
+            path (str): API path of the list endpoint
+            params (dict[str, Any] | None): extra query parameters
+            page_size (int): number of items requested per page
+            first (dict[str, Any] | None): first page, if the caller already fetched it
 
         Raises:
             ApiError: API failed to comply with request
 
-        Returns:
-            None
+        Yields:
+            dict[str, Any]: response bodies, with the "items" and "total" of the listing
         """
-        headers = self._login()
+        page = 1
+        previous = None
+        while True:
+            if page == 1 and first is not None:
+                body = first
+            else:
+                body = self._get_json(path, {**(params or {}), "page": page, "size": page_size})
+            items = body.get("items", [])
+            if items == previous:
+                # the server ignores the page parameter
+                logger.warning("%s returned page %d twice, stopping", path, page - 1)
+                return
+            yield body
+            total = body.get("total")
+            if len(items) < page_size or (total is not None and page * page_size >= total):
+                return
+            previous = items
+            page += 1
 
-        resp = requests.get(
-            f"{self._url}/api/v1/sites",
-            params={"cluster_id": cluster_id},
-            headers=headers,  # type: ignore
-        )
-        if not resp.ok:
-            raise ApiError(f"Failed to query sites: {resp.text}")
+    def iter_items(
+        self,
+        path: str,
+        params: dict[str, Any] | None = None,
+        page_size: int = PAGE_SIZE,
+        first: dict[str, Any] | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """Iterate over the items of a paginated list endpoint, see `iter_pages`.
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Yields:
+            dict[str, Any]: listed items
+        """
+        for body in self.iter_pages(path, params, page_size, first):
+            yield from body.get("items", [])
+
+    def count_sites(self) -> int:
+        """Return the number of enrolled sites.
+
+        Raises:
+            ApiError: API failed to comply with request
+        """
+        return int(self._get_json("/api/v1/sites", {"page": 1, "size": 1}).get("total", 0))
+
+    def find_site(self, cluster_id: str) -> str | None:
+        """Find the site registered for a MAAS cluster.
 
-        sites = resp.json().get("items")
+        Args:
+            cluster_id (str): MAAS cluster UUID
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            str | None: ID of the active or pending site, if any
+        """
+        sites = list(
+            itertools.islice(self.iter_items("/api/v1/sites", {"cluster_id": cluster_id}), 2)
+        )
         if len(sites) > 1:
             raise ApiError(
                 f"More than one sites with the same cluster_id: {[site['id'] for site in sites]}"
             )
         elif len(sites) == 1:
-            resp = requests.delete(
-                f"{self._url}/api/v1/sites/{sites[0]['id']}",
-                headers=headers,  # type: ignore
-            )
-            if not resp.ok:
-                raise ApiError(f"Failed to delete site: {resp.text}")
-            return
+            return sites[0]["id"]
 
-        # search pending sites
-        resp = requests.get(
-            f"{self._url}/api/v1/sites/pending",
-            headers=headers,  # type: ignore
+        # search pending sites: older servers ignore the filter there, so
+        # their listing is filtered on the client and read until a duplicate
+        # shows up. Its pages past the first are cached, unchanged ones are
+        # revalidated instead of downloaded again.
+        path = "/api/v1/sites/pending"
+        first = None
+        if not self._pending_filter_ignored:
+            first = self._get_json(path, {"cluster_id": cluster_id, "page": 1, "size": PAGE_SIZE})
+            self._pending_filter_ignored = any(
+                site["cluster_id"] != cluster_id for site in first.get("items", [])
+            )
+        matches = (
+            site["id"]
+            for site in self.iter_items(path, first=first)
+            if site["cluster_id"] == cluster_id
         )
+        pending = list(itertools.islice(matches, 2))
+        if len(pending) > 1:
+            raise ApiError(f"More than one pending sites with the same cluster_id: {pending}")
+        return pending[0] if pending else None
+
+    def remove_site(self, cluster_id: str) -> None:
+        """Remove a MAAS Site from MAAS Site Manager.
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            None
+        """
+        if site_id := self.find_site(cluster_id):
+            self.delete_site(site_id)
+
+    def delete_site(self, site_id: str) -> None:
+        """Delete a site by its ID.
+
+        Raises:
+            ApiError: API failed to comply with request
+        """
+        resp = self._request("delete", f"/api/v1/sites/{site_id}")
         if not resp.ok:
-            raise ApiError(f"Failed to query pending sites: {resp.text}")
+            raise ApiError(f"Failed to delete site: {resp.text}")
 
-        sites = resp.json().get("items")
-        # perform check with Python since we cannot filter pending sites from the API
-        sites_with_cluster_id = [site["id"] for site in sites if site["cluster_id"] == cluster_id]
-        if len(sites_with_cluster_id) > 1:
-            raise ApiError(
-                f"More than one pending sites with the same cluster_id: {sites_with_cluster_id}"
-            )
-        elif len(sites_with_cluster_id) == 1:
-            resp = requests.delete(
-                f"{self._url}/api/v1/sites/{sites_with_cluster_id[0]}",
-                headers=headers,  # type: ignore
-            )
-            if not resp.ok:
-                raise ApiError(f"Failed to delete site: {resp.text}")
+    def index_sites(self, cluster_ids: Iterable[str]) -> dict[str, str]:
+        """Map MAAS clusters to their site with a single sweep of the site listings.
+
+        The sweep stops as soon as every requested cluster has been found.
+        A single cluster is looked up with the server-side filter instead.
+
+        Args:
+            cluster_ids (Iterable[str]): MAAS cluster UUIDs to look up
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            dict[str, str]: site ID for each cluster ID that was found
+        """
+        wanted = set(cluster_ids)
+        if len(wanted) == 1:
+            # a filtered lookup is cheaper than a sweep for a single cluster
+            (cluster_id,) = wanted
+            site_id = self.find_site(cluster_id)
+            return {cluster_id: site_id} if site_id else {}
+        index: dict[str, str] = {}
+        for path in ("/api/v1/sites", "/api/v1/sites/pending"):
+            for site in self.iter_items(path):
+                if site.get("cluster_id") in wanted:
+                    index.setdefault(site["cluster_id"], site["id"])
+                    if len(index) == len(wanted):
+                        return index
+        return index
+
+    def remove_sites(
+        self, cluster_ids: Iterable[str], parallelism: int = DEFAULT_DELETE_PARALLELISM
+    ) -> dict[str, SiteRemoval]:
+        """Remove several MAAS Sites from MAAS Site Manager.
+
+        Sites are looked up with a single sweep and deleted concurrently.
+        A failure to delete one site does not prevent the others from
+        being removed. Callbacks only run on the calling thread.
+
+        Args:
+            cluster_ids (Iterable[str]): MAAS cluster UUIDs of the sites to remove
+            parallelism (int): maximum number of concurrent delete requests
+
+        Raises:
+            ApiError: API failed to list the sites
+
+        Returns:
+            dict[str, SiteRemoval]: outcome for each cluster ID
+        """
+        cluster_ids = list(dict.fromkeys(cluster_ids))
+        if not cluster_ids:
+            return {}
+        index = self.index_sites(cluster_ids)
+        results = dict.fromkeys(cluster_ids, SiteRemoval.NOT_FOUND)
+
+        if index:
+            # log in before the workers start instead of from each of them
+            self._login()
+            workers = max(1, min(parallelism, self._pool_size, len(index)))
+            aclient = AsyncSiteManagerClient(self, max_concurrency=workers)
+            try:
+                outcomes = run_batch(aclient.delete_site(index[c]) for c in index)
+            finally:
+                aclient.close()
+            for cluster_id, outcome in zip(index, outcomes):
+                if isinstance(outcome, (requests.RequestException, ApiError)):
+                    logger.error("Failed to delete site for %s: %s", cluster_id, outcome)
+                    results[cluster_id] = SiteRemoval.FAILED
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+                else:
+                    results[cluster_id] = SiteRemoval.REMOVED
+        return results
+
+
+class AsyncSiteManagerClient:
+    """Asyncio facade over a SiteManagerClient.
+
+    Requests are sent through the connection pool of the wrapped client from
+    a bounded set of worker threads, so coroutines awaiting different
+    requests overlap their network waits. The `on_login` and circuit breaker
+    callbacks of the wrapped client are held back until `close`, which runs
+    them from the calling thread. The wrapped client stays open.
+    """
+
+    def __init__(self, client: SiteManagerClient, max_concurrency: int | None = None) -> None:
+        self._client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency or client.pool_size)
+        self._callbacks = contextlib.ExitStack()
+        self._callbacks.enter_context(client.deferred_callbacks())
+
+    async def __aenter__(self) -> "AsyncSiteManagerClient":
+        """Enter the client context."""
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        """Close the client on context exit."""
+        self.close()
+
+    def close(self) -> None:
+        """Stop the worker threads and run the held back callbacks."""
+        self._executor.shutdown(wait=True)
+        self._callbacks.close()
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a blocking client call on the worker threads."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def login(self) -> dict[str, str]:
+        """Authenticate client.
+
+        Concurrent callers wait for a single login of the wrapped client.
+        """
+        return await self._run(self._client.login)
+
+    async def issue_enroll_token(self) -> str:
+        """Issue an enrollment token.
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            str: encoded JWT enrollment token
+        """
+        return await self._run(self._client.issue_enroll_token)
+
+    async def issue_enroll_tokens(
+        self, count: int, duration: int = ENROLL_TOKEN_DURATION
+    ) -> list[tuple[str, float]]:
+        """Issue a batch of enrollment tokens in a single request.
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            list[tuple[str, float]]: encoded JWT enrollment tokens and their expiry timestamp
+        """
+        return await self._run(self._client.issue_enroll_tokens, count, duration)
+
+    async def find_site(self, cluster_id: str) -> str | None:
+        """Find the site registered for a MAAS cluster.
+
+        Raises:
+            ApiError: API failed to comply with request
+
+        Returns:
+            str | None: ID of the active or pending site, if any
+        """
+        return await self._run(self._client.find_site, cluster_id)
+
+    async def delete_site(self, site_id: str) -> None:
+        """Delete a site by its ID.
+
+        Raises:
+            ApiError: API failed to comply with request
+        """
+        await self._run(self._client.delete_site, site_id)
+
+    async def remove_site(self, cluster_id: str) -> None:
+        """Remove a MAAS Site from MAAS Site Manager.
+
+        Raises:
+            ApiError: API failed to comply with request
+        """
+        await self._run(self._client.remove_site, cluster_id)
+
+
+def run_batch(aws: Iterable[Awaitable[T]]) -> list[T | BaseException]:
+    """Run a batch of awaitables concurrently from synchronous code, such as a hook.
+
+    Args:
+        aws (Iterable[Awaitable[T]]): coroutines to run
+
+    Returns:
+        list[T | BaseException]: result or raised exception of each awaitable, in order
+    """
+
+    async def gather() -> list[T | BaseException]:
+        return await asyncio.gather(*aws, return_exceptions=True)
+
+    return asyncio.run(gather())
@@ -5,17 +5,20 @@
 # Learn more at: https://juju.is/docs/sdk
 """MAAS Site Manager Charm."""
 
+import functools
+import hashlib
 import json
 import logging
+import math
 import os
 import secrets
 import string
+import time
 from typing import Any, cast
 from urllib.parse import urlparse
 
 import ops
 import requests
-import yaml
 from charms.certificate_transfer_interface.v1.certificate_transfer import (
     CertificatesAvailableEvent,
     CertificatesRemovedEvent,
@@ -45,28 +48,92 @@ from charms.traefik_k8s.v2.ingress import (
 from ops.pebble import CheckStatus
 from requests.exceptions import RequestException
 
-from api import SiteManagerClient
+from api import (
+    LATENCY_BUCKETS,
+    ApiError,
+    ApiStats,
+    AuthError,
+    CircuitBreaker,
+    ResponseCache,
+    SiteManagerClient,
+    SiteRemoval,
+)
+from tuning import Tuning, config_hash, db_pool
+from tuning import parse as parse_tuning
 
 # Log messages can be retrieved using juju debug-log
 logger = logging.getLogger(__name__)
 
 VALID_LOG_LEVELS = ["info", "debug", "warning", "error", "critical", "trace"]
+VALID_SERVERS = ["uvicorn", "gunicorn"]
+VALID_HTTP_PROTOCOLS = ["auto", "httptools", "h11"]
+VALID_DB_POOLERS = ["none", "pgbouncer"]
+VALID_IMAGE_SERVING_MODES = ["proxy", "redirect"]
+UVICORN_APP = "msm.apiserver.main:create_app"
 SERVICE_PORT = 8000
+DEFAULT_DB_PORT = "5432"
+S3_CA_CHAIN_FILE = "/etc/msm/s3-ca-chain.pem"
+S3_OPTIONAL_FIELDS = ["region", "s3-uri-style", "storage-class", "s3-api-version"]
+IMAGE_CACHE_STORAGE = "image-cache"
+# mount location of the image-cache storage in the workload container
+IMAGE_CACHE_DIR = "/var/cache/msm/images"
 MSM_PEER_NAME = "site-manager-cluster"
 MSM_CREDS_ID = "site-manager-operator-cred-id"
 MSM_CREDS_SECRET = "site-manager-operator-cred"
+MSM_ACCESS_TOKEN_KEY = "access-token"
+MSM_PENDING_SITE_REMOVALS = "pending-site-removals"
+MSM_APPLIED_LAYER_HASH = "applied-layer-hash"
+MSM_SITE_COUNT = "site-count"
+MSM_ENROLL_TOKEN_POOL_SECRET = "site-manager-enroll-token-pool"
+ENROLL_TOKEN_POOL_SIZE = 20
+ENROLL_TOKEN_POOL_LOW_WATERMARK = 5
+# pooled tokens expiring sooner than this (seconds) are discarded
+ENROLL_TOKEN_MIN_TTL = 600
+# time (seconds) a hook may spend on MSM API calls
+HOOK_API_BUDGET = 60
+# time (seconds) a restart may take beyond the graceful shutdown of the service
+SERVICE_RESTART_MARGIN = 30
+# cgroup files describing the workload container CPU quota
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
 SCOPE = "unit"
 TLS_TRANSFER_RELATION = "receive-ca-cert"
-ALLOWABLE_ENV_VARS = [
-    "MSM_CONN_LOST_THRESHOLD_SEC",
-    "MSM_HEARTBEAT_INTERVAL_SEC",
-    "MSM_METRICS_REFRESH_INTERVAL_SEC",
-    "MSM_IMAGE_SERVING_CHUNK_SIZE_BYTES",
-]
 
 PASSWD_CHOICES = string.ascii_letters + string.digits
 
 
+def parse_endpoints(endpoints: str) -> list[tuple[str, str]]:
+    """Split a comma separated list of database endpoints.
+
+    Endpoints are "host:port" pairs; IPv6 addresses may be written in
+    brackets ("[::1]:5432"). The PostgreSQL default port is assumed when an
+    endpoint has none.
+
+    Args:
+        endpoints (str): endpoints as published in the database relation
+
+    Returns:
+        list[tuple[str, str]]: host and port of each endpoint
+    """
+    result = []
+    for endpoint in filter(None, (e.strip() for e in endpoints.split(","))):
+        if endpoint.startswith("["):
+            host, _, port = endpoint[1:].partition("]")
+            port = port.removeprefix(":")
+        elif endpoint.count(":") == 1:
+            host, port = endpoint.split(":")
+        else:  # hostname or IPv6 address without port
+            host, port = endpoint, ""
+        result.append((host, port or DEFAULT_DB_PORT))
+    return result
+
+
+def format_endpoint(host: str, port: str) -> str:
+    """Join a host and port, bracketing IPv6 addresses."""
+    return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+
+
 class DatabaseNotReadyError(Exception):
     """Signals that the database cannot yet be used."""
 
@@ -95,13 +162,22 @@ class TemporalWorkerNotConfiguredError(Exception):
         LokiPushApiConsumer,
         MetricsEndpointProvider,
         IngressPerAppRequirer,
+        SiteManagerClient,
     ],
 )
 class MsmOperatorCharm(ops.CharmBase):
     """MAAS Site Manager Charm."""
 
+    _stored = ops.StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
+        self._dispatch_started = time.monotonic()
+        self._image_cache_detaching = False
+        self._stored.set_default(api_circuit={}, api_stats="{}", api_cache="{}", tuning={})
+        self._api_stats = ApiStats(json.loads(self._stored.api_stats))
+        self._api_cache = ResponseCache(json.loads(self._stored.api_cache))
+        self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
 
         self.container = self.unit.get_container("site-manager")
         self.pebble_service_name = "msm"
@@ -124,10 +200,19 @@ class MsmOperatorCharm(ops.CharmBase):
         self.tracing = TracingEndpointRequirer(self, protocols=["otlp_http"])
         self.charm_tracing_endpoint, _ = charm_tracing_config(self.tracing, None)
 
+        self.framework.observe(self.on["site-manager"].pebble_ready, self._reconcile)
+        self.framework.observe(self.on.config_changed, self._reconcile)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on[IMAGE_CACHE_STORAGE].storage_attached, self._reconcile)
         self.framework.observe(
-            self.on["site-manager"].pebble_ready, self._update_layer_and_restart
+            self.on[IMAGE_CACHE_STORAGE].storage_detaching, self._on_image_cache_detaching
         )
-        self.framework.observe(self.on.config_changed, self._update_layer_and_restart)
+        self.framework.observe(
+            self.on[MSM_PEER_NAME].relation_changed, self._on_peer_relation_changed
+        )
+        # database pools are sized from the number of units
+        self.framework.observe(self.on[MSM_PEER_NAME].relation_joined, self._reconcile)
+        self.framework.observe(self.on[MSM_PEER_NAME].relation_departed, self._reconcile)
         self.framework.observe(
             self.on["site-manager"].pebble_check_recovered, self._on_pebble_check_recovered
         )
@@ -138,9 +223,15 @@ class MsmOperatorCharm(ops.CharmBase):
         self.framework.observe(enroll_events.relation_joined, self._on_maas_enroll_joined)
         self.framework.observe(enroll_events.relation_broken, self._on_maas_enroll_broken)
 
+        # Secrets rewritten by the charm
+        self.framework.observe(self.on.secret_remove, self._on_secret_remove)
+
         # Database connection
         self.framework.observe(self._database.on.database_created, self._on_database_created)
         self.framework.observe(self._database.on.endpoints_changed, self._on_database_created)
+        self.framework.observe(
+            self._database.on.read_only_endpoints_changed, self._on_database_created
+        )
         self.framework.observe(
             self.on.database_relation_broken, self._on_database_relation_removed
         )
@@ -181,15 +272,20 @@ class MsmOperatorCharm(ops.CharmBase):
 
         # Charm actions
         self.framework.observe(self.on.create_admin_action, self._on_create_admin_action)
+        self.framework.observe(self.on.get_api_stats_action, self._on_get_api_stats_action)
 
         self.bucket = "msm-images"
         self.s3_requirer = S3Requirer(self, "s3", self.bucket)
-        self.framework.observe(
-            self.s3_requirer.on.credentials_changed, self._update_layer_and_restart
-        )
+        self.framework.observe(self.s3_requirer.on.credentials_changed, self._reconcile)
+
+    def _reconcile(self, event):
+        """Bring the workload in line with the configuration and relations.
 
-    def _update_layer_and_restart(self, event):
-        """Handle changed configuration."""
+        Every event affecting the workload lands here. The desired Pebble layer
+        is rendered from the current state and applied only if it differs from
+        the one last applied by this unit, so a burst of events restarts the
+        service at most once.
+        """
         self.unit.status = ops.MaintenanceStatus("Assembling pod spec")
 
         # Fetch the new config value
@@ -208,6 +304,7 @@ class MsmOperatorCharm(ops.CharmBase):
 
         # push CA certificates
         self._dump_all_certificates()
+        self._push_s3_ca_chain()
 
         try:
             layer = self._pebble_layer
@@ -231,8 +328,7 @@ class MsmOperatorCharm(ops.CharmBase):
         self._add_log_targets(layer)
 
         # Push an updated layer with the new config
-        self.container.add_layer("site-manager", layer, combine=True)
-        self.container.restart(self.pebble_service_name)
+        self._apply_layer(layer)
 
         if self.container.get_check("http-test").status == CheckStatus.UP:
             self._set_workload_version()
@@ -244,6 +340,43 @@ class MsmOperatorCharm(ops.CharmBase):
         else:
             self.unit.status = ops.WaitingStatus("Waiting for msm service to become available")
 
+    def _service_running(self) -> bool:
+        """Whether the workload service is defined and running."""
+        services = self.container.get_services(self.pebble_service_name)
+        return bool(services) and services[self.pebble_service_name].is_running()
+
+    def _apply_layer(self, layer: ops.pebble.LayerDict) -> None:
+        """Add the layer to the plan, restarting the service only if it changed.
+
+        Unchanged service definitions are replanned instead, which starts the
+        service if it is not running without interrupting in-flight requests.
+        A layer already applied by this unit is skipped entirely while the
+        service is running.
+        """
+        layer_hash = hashlib.sha256(json.dumps(layer, sort_keys=True).encode()).hexdigest()
+        if (
+            layer_hash == self.get_peer_data(self.unit, MSM_APPLIED_LAYER_HASH)
+            and self._service_running()
+        ):
+            logger.debug("workload already up to date")
+            return
+        current = self.container.get_plan().services.get(self.pebble_service_name)
+        self.container.add_layer("site-manager", layer, combine=True)
+        updated = self.container.get_plan().services.get(self.pebble_service_name)
+        if current is None or updated is None or current.to_dict() != updated.to_dict():
+            logger.info("msm service definition changed, restarting")
+            # stopping waits up to the kill-delay for in-flight requests
+            timeout = self.tuning.options["graceful-timeout"] + SERVICE_RESTART_MARGIN
+            try:
+                self.container.pebble.restart_services([self.pebble_service_name], timeout=timeout)
+            except (ops.pebble.ChangeError, ops.pebble.TimeoutError) as e:
+                # the layer is applied again by the next hook
+                logger.warning("failed to restart msm service: %s", e)
+                return
+        else:
+            self.container.replan()
+        self.set_peer_data(self.unit, MSM_APPLIED_LAYER_HASH, layer_hash)
+
     def _on_pebble_check_recovered(self, event: ops.PebbleCheckRecoveredEvent) -> None:
         logger.info("msm service recovered")
         self._set_workload_version()
@@ -255,7 +388,7 @@ class MsmOperatorCharm(ops.CharmBase):
 
     def _on_database_created(self, event: DatabaseCreatedEvent) -> None:
         """Event is fired when Postgres database is created."""
-        self._update_layer_and_restart(event)
+        self._reconcile(event)
 
     def _on_database_relation_removed(self, event) -> None:
         """Event is fired when relation with Postgres is broken."""
@@ -263,24 +396,24 @@ class MsmOperatorCharm(ops.CharmBase):
 
     def _on_loki_push_api_endpoint_joined(self, event) -> None:
         """Event is fired when relation with Loki is established."""
-        self._update_layer_and_restart(event)
+        self._reconcile(event)
 
     def _on_loki_push_api_endpoint_departed(self, event) -> None:
         """Event is fired when relation with Loki is removed."""
-        self._update_layer_and_restart(event)
+        self._reconcile(event)
 
     def _on_ingress_ready(self, event: IngressPerAppReadyEvent):
         logger.info("This app's ingress URL: %s", event.url)
-        self._update_layer_and_restart(event)
+        self._reconcile(event)
 
     def _on_ingress_revoked(self, event: IngressPerAppRevokedEvent):
         logger.info("This app no longer has ingress")
-        self._update_layer_and_restart(event)
+        self._reconcile(event)
 
     def _on_temporal_info_changed(
         self, event: TemporalHostInfoChangedEvent | TemporalWorkerInfoRelationReadyEvent
     ):
-        self._update_layer_and_restart(event)
+        self._reconcile(event)
 
     def _add_log_targets(self, layer: ops.pebble.LayerDict) -> None:
         """Set up logging with Loki."""
@@ -315,18 +448,118 @@ class MsmOperatorCharm(ops.CharmBase):
                 target["services"] = []
 
     @property
-    def _pebble_layer(self) -> ops.pebble.LayerDict:
-        """Return a dictionary representing a Pebble layer."""
+    def image_serving_mode(self) -> str:
+        """How boot images are served to MAAS sites.
+
+        Raises:
+            ValueError: the image-serving-mode option is not supported
+        """
+        mode = str(self.model.config["image-serving-mode"]).lower()
+        if mode not in VALID_IMAGE_SERVING_MODES:
+            raise ValueError(
+                f"image-serving-mode must be one of {', '.join(VALID_IMAGE_SERVING_MODES)},"
+                f" got '{mode}'"
+            )
+        return mode
+
+    @property
+    def server(self) -> str:
+        """Process manager running the API.
+
+        Raises:
+            ValueError: the server option is not supported
+        """
+        server = str(self.model.config["server"]).lower()
+        if server not in VALID_SERVERS:
+            raise ValueError(f"server must be one of {', '.join(VALID_SERVERS)}, got '{server}'")
+        return server
+
+    @property
+    def http_protocol(self) -> str:
+        """HTTP protocol implementation used by uvicorn.
+
+        Raises:
+            ValueError: the http option is not supported
+        """
+        http = str(self.model.config["http"]).lower()
+        if http not in VALID_HTTP_PROTOCOLS:
+            raise ValueError(
+                f"http must be one of {', '.join(VALID_HTTP_PROTOCOLS)}, got '{http}'"
+            )
+        return http
+
+    def _uvicorn_command(self) -> list[str]:
+        """Command line running the API in uvicorn."""
         cmd_line = [
             "uvicorn",
             "--host 0.0.0.0",
             f"--port {SERVICE_PORT}",
             "--factory",
             "--loop uvloop",
+            f"--backlog {self.tuning.options['backlog']}",
+            f"--timeout-keep-alive {self.tuning.options['timeout-keep-alive']}",
+            f"--timeout-graceful-shutdown {self.tuning.options['graceful-timeout']}",
         ]
         if self.root_path:
             cmd_line.append(f"--root-path {self.root_path}")
-        cmd_line.append("msm.apiserver.main:create_app")
+        if (workers := self.workers) > 1:
+            cmd_line.append(f"--workers {workers}")
+            # a single process exiting would stop the whole service
+            if limit_max_requests := self.tuning.options["limit-max-requests"]:
+                cmd_line.append(f"--limit-max-requests {limit_max_requests}")
+        if limit_concurrency := self.tuning.options["limit-concurrency"]:
+            cmd_line.append(f"--limit-concurrency {limit_concurrency}")
+        if (http := self.http_protocol) != "auto":
+            cmd_line.append(f"--http {http}")
+        if http == "h11":
+            size = self.tuning.options["h11-max-incomplete-event-size"]
+            cmd_line.append(f"--h11-max-incomplete-event-size {size}")
+        cmd_line.append(UVICORN_APP)
+        return cmd_line
+
+    def _gunicorn_command(self) -> list[str]:
+        """Command line running the API in gunicorn with uvicorn workers.
+
+        Raises:
+            ValueError: the API is served under a path prefix, which uvicorn
+                workers cannot be given
+        """
+        if self.root_path:
+            raise ValueError(
+                f"server 'gunicorn' cannot serve the ingress path prefix {self.root_path},"
+                " use server 'uvicorn'"
+            )
+        worker_class = (
+            "uvicorn.workers.UvicornH11Worker"
+            if self.http_protocol == "h11"
+            else "uvicorn.workers.UvicornWorker"
+        )
+        cmd_line = [
+            "gunicorn",
+            f"--bind 0.0.0.0:{SERVICE_PORT}",
+            f"--worker-class {worker_class}",
+            f"--workers {self.workers}",
+            f"--backlog {self.tuning.options['backlog']}",
+            f"--keep-alive {self.tuning.options['timeout-keep-alive']}",
+            f"--graceful-timeout {self.tuning.options['graceful-timeout']}",
+        ]
+        if max_requests := self.tuning.options["max-requests"]:
+            cmd_line.append(f"--max-requests {max_requests}")
+            cmd_line.append(f"--max-requests-jitter {self.tuning.options['max-requests-jitter']}")
+        if self.model.config["preload"]:
+            cmd_line.append("--preload")
+        cmd_line.append(f"'{UVICORN_APP}()'")
+        return cmd_line
+
+    @property
+    def _pebble_layer(self) -> ops.pebble.LayerDict:
+        """Return a dictionary representing a Pebble layer."""
+        cmd_line = (
+            self._gunicorn_command() if self.server == "gunicorn" else self._uvicorn_command()
+        )
+        # Pebble waits this long after SIGTERM before killing the server,
+        # letting in-flight requests such as image downloads complete
+        graceful_timeout = self.tuning.options["graceful-timeout"]
         layer = {
             "summary": "site-manager layer",
             "description": "pebble config layer for site-manager",
@@ -337,6 +570,7 @@ class MsmOperatorCharm(ops.CharmBase):
                     "command": " ".join(cmd_line),
                     "startup": "enabled",
                     "environment": self.app_environment,
+                    "kill-delay": f"{graceful_timeout}s",
                 },
             },
             "checks": {
@@ -361,6 +595,37 @@ class MsmOperatorCharm(ops.CharmBase):
                 logger.exception("unable to get version from API")
         return ""
 
+    @property
+    def workers(self) -> int:
+        """Number of uvicorn worker processes.
+
+        Raises:
+            TuningError: the workers option is neither "auto" nor a valid count
+        """
+        if (workers := self.tuning.workers) is None:
+            quota = self._cpu_quota()
+            return max(1, math.ceil(quota)) if quota else 1
+        return workers
+
+    def _cpu_quota(self) -> float | None:
+        """Read the CPU quota of the workload container from its cgroup.
+
+        Returns:
+            float | None: quota in CPUs, None if the container is not limited
+        """
+        try:
+            try:
+                quota, period = self.container.pull(CGROUP_V2_CPU_MAX).read().split()
+            except ops.pebble.PathError:
+                quota = self.container.pull(CGROUP_V1_CPU_QUOTA).read().strip()
+                period = self.container.pull(CGROUP_V1_CPU_PERIOD).read().strip()
+            if quota in ("max", "-1"):
+                return None
+            return int(quota) / int(period)
+        except (ops.pebble.PathError, ValueError) as e:
+            logger.warning("unable to read the workload container CPU quota: %s", e)
+            return None
+
     @property
     def root_path(self) -> str | None:
         """Get external path prefix handled by the proxy."""
@@ -381,8 +646,9 @@ class MsmOperatorCharm(ops.CharmBase):
         """
         db_data = self._fetch_postgres_relation_data()
         s3_data = self._fetch_s3_connection_info()
-        env_config = self._get_environment_config()
+        env_config = {name: str(value) for name, value in self.tuning.environment.items()}
         temporal_data = self._fetch_temporal_relation_data()
+        ca_chain = s3_data.get("tls-ca-chain")
 
         env = {
             "UVICORN_LOG_LEVEL": self.model.config["log-level"],
@@ -391,40 +657,108 @@ class MsmOperatorCharm(ops.CharmBase):
             "MSM_DB_USER": db_data.get("db_username", None),
             "MSM_DB_NAME": db_data.get("db_name", None),
             "MSM_DB_PASSWORD": db_data.get("db_password", None),
+            # all endpoints, the driver connects to the first one accepting writes
+            "MSM_DB_HOSTS": db_data.get("db_hosts", None),
+            "MSM_DB_TARGET_SESSION_ATTRS": "read-write" if db_data.get("db_hosts") else None,
+            # comma separated host:port list, read queries are routed to it when set
+            "MSM_DB_RO_HOSTS": (
+                db_data.get("db_ro_hosts") or None
+                if self.model.config["db-read-replicas"]
+                else None
+            ),
+            "MSM_DB_POOLER": db_data.get("db_pooler"),
+            # transaction pooling can't keep server-side prepared statements
+            "MSM_DB_STATEMENT_CACHE_SIZE": "0" if db_data.get("db_pooler") else None,
             "MSM_BASE_PATH": self._ingress.url,
             "MSM_S3_ACCESS_KEY": s3_data.get("access-key", None),
             "MSM_S3_SECRET_KEY": s3_data.get("secret-key", None),
             "MSM_S3_ENDPOINT": s3_data.get("endpoint", None),
             "MSM_S3_BUCKET": s3_data.get("bucket", None),
             "MSM_S3_PATH": s3_data.get("path", None),
+            "MSM_S3_REGION": s3_data.get("region", None),
+            "MSM_S3_URI_STYLE": s3_data.get("s3-uri-style", None),
+            "MSM_S3_STORAGE_CLASS": s3_data.get("storage-class", None),
+            "MSM_S3_API_VERSION": s3_data.get("s3-api-version", None),
+            # written to the workload container by _push_s3_ca_chain
+            "MSM_S3_TLS_CA_FILE": S3_CA_CHAIN_FILE if ca_chain else None,
+            # changes the layer, restarting the workload, when the chain rotates
+            "MSM_S3_TLS_CA_SHA256": (
+                hashlib.sha256(ca_chain.encode()).hexdigest() if ca_chain else None
+            ),
+            "MSM_S3_MULTIPART_PART_SIZE_BYTES": str(
+                self.tuning.options["s3-multipart-part-size"] * 1024 * 1024
+            ),
+            "MSM_S3_MAX_CONCURRENCY": str(self.tuning.options["s3-max-concurrency"]),
+            "MSM_IMAGE_SERVING_MODE": self.image_serving_mode,
+            **self._image_cache_environment(),
+            "MSM_S3_PRESIGN_TTL_SEC": (
+                str(self.tuning.options["image-presign-ttl"])
+                if self.image_serving_mode == "redirect"
+                else None
+            ),
             "MSM_TEMPORAL_SERVER_ADDRESS": temporal_data.get("host", None),
             "MSM_TEMPORAL_NAMESPACE": temporal_data.get("namespace", None),
             "MSM_TEMPORAL_TASK_QUEUE": temporal_data.get("queue", None),
             "MSM_TEMPORAL_TLS_ROOT_CAS": self.model.config["temporal-tls-root-cas"],
         }
+        pool = db_pool(
+            self.tuning.options["db-max-connections"], self.workers * self.app.planned_units()
+        )
+        env["MSM_DB_POOL_SIZE"] = str(pool["size"])
+        env["MSM_DB_MAX_OVERFLOW"] = str(pool["max_overflow"])
+        env["MSM_DB_POOL_TIMEOUT_SEC"] = str(pool["timeout"])
+        # explicit settings take precedence over computed ones
         env.update(env_config)
+        if self.tuning.heartbeat_mode == "adaptive":
+            interval, threshold = self.tuning.heartbeat(self._site_count())
+            env["MSM_HEARTBEAT_INTERVAL_SEC"] = str(interval)
+            env["MSM_CONN_LOST_THRESHOLD_SEC"] = str(threshold)
         return env
 
-    def _get_environment_config(self) -> dict[str, Any]:
-        """Parse environment configuration from charm config.
+    def _push_s3_ca_chain(self) -> None:
+        """Write the CA chain of the S3 endpoint, if it has one, to the workload container."""
+        try:
+            chain = self._fetch_s3_connection_info().get("tls-ca-chain")
+        except S3IntegrationNotReadyError:
+            return
+        if chain:
+            self.container.push(S3_CA_CHAIN_FILE, chain, make_dirs=True)
+
+    def _image_cache_environment(self) -> dict[str, str | None]:
+        """Image cache settings, enabled when the image-cache storage is attached."""
+        if self._image_cache_detaching or not self.model.storages[IMAGE_CACHE_STORAGE]:
+            return {
+                "MSM_IMAGE_CACHE_DIR": None,
+                "MSM_IMAGE_CACHE_MAX_SIZE_BYTES": None,
+                "MSM_IMAGE_CACHE_EVICTION_POLICY": None,
+            }
+        max_size = self.tuning.options["image-cache-max-size"] * 1024 * 1024
+        return {
+            "MSM_IMAGE_CACHE_DIR": IMAGE_CACHE_DIR,
+            "MSM_IMAGE_CACHE_MAX_SIZE_BYTES": str(max_size),
+            "MSM_IMAGE_CACHE_EVICTION_POLICY": self.tuning.cache_eviction_policy,
+        }
 
-        Returns:
-            dict[str, Any]: environment configuration
+    def _site_count(self) -> int:
+        """Best known number of sites sending heartbeats."""
+        enrolled = len(self.model.relations[enroll.DEFAULT_ENDPOINT_NAME])
+        return max(enrolled, self.get_peer_data(self.app, MSM_SITE_COUNT) or 0)
+
+    @property
+    def tuning(self) -> Tuning:
+        """Validated workload tuning settings.
+
+        Settings are validated once per configuration change; the result is
+        kept in the stored state keyed by a hash of the configuration and of
+        the tuning schema version, so an upgraded charm does not reuse them.
+
+        Raises:
+            TuningError: a setting is invalid
         """
-        env_config_str = str(self.model.config.get("environment", "[]"))
-        try:
-            env_config = yaml.safe_load(env_config_str)
-            if not isinstance(env_config, list):
-                raise ValueError("Environment configuration must be in YAML format as a list.")
-            environment = {}
-            for item in env_config:
-                if item["name"] not in ALLOWABLE_ENV_VARS:
-                    raise ValueError(f"Invalid environment variable: {item['name']}")
-                environment[item["name"]] = item["value"]
-            return environment
-        except yaml.YAMLError as e:
-            logger.error("Failed to parse environment configuration: %s", str(e))
-            raise ValueError("Failed to parse environment configuration.")
+        digest = config_hash(self.model.config)
+        if self._stored.tuning.get("hash") != digest:
+            self._stored.tuning = {"hash": digest, **parse_tuning(self.model.config).to_dict()}
+        return Tuning.from_dict(self._stored.tuning)
 
     def _request_version(self) -> str:  # pragma: nocover
         """Fetch the version from the running workload using the API."""
@@ -458,13 +792,20 @@ class MsmOperatorCharm(ops.CharmBase):
             if not data:
                 continue
             try:
-                host, port = data["endpoints"].split(":")
+                endpoints = parse_endpoints(data["endpoints"])
+                ro_endpoints = parse_endpoints(data.get("read-only-endpoints", ""))
+                if not endpoints:
+                    raise DatabaseNotReadyError()
+                host, port = endpoints[0]
                 db_data = {
                     "db_host": host,
                     "db_port": port,
+                    "db_hosts": ",".join(format_endpoint(*e) for e in endpoints),
                     "db_username": data["username"],
                     "db_password": data["password"],
                     "db_name": data["database"],
+                    "db_ro_hosts": ",".join(format_endpoint(*e) for e in ro_endpoints),
+                    "db_pooler": self._db_pooler(),
                 }
             except KeyError:
                 raise DatabaseNotReadyError()
@@ -472,6 +813,22 @@ class MsmOperatorCharm(ops.CharmBase):
                 return db_data
         raise DatabaseNotReadyError()
 
+    def _db_pooler(self) -> str | None:
+        """Return the connection pooler between the workload and PostgreSQL, if any.
+
+        The database relation does not tell a pooler from PostgreSQL itself,
+        so the pooler is only known from the db-pooler option.
+
+        Raises:
+            ValueError: the db-pooler option is not supported
+        """
+        pooler = str(self.model.config["db-pooler"]).lower()
+        if pooler not in VALID_DB_POOLERS:
+            raise ValueError(
+                f"db-pooler must be one of {', '.join(VALID_DB_POOLERS)}, got '{pooler}'"
+            )
+        return None if pooler == "none" else pooler
+
     def _fetch_s3_connection_info(self) -> dict[str, str]:
         """Fetch s3 connection info."""
         if connection_info := self.s3_requirer.get_s3_connection_info():
@@ -482,6 +839,13 @@ class MsmOperatorCharm(ops.CharmBase):
                     "endpoint": connection_info["endpoint"],
                     "bucket": connection_info["bucket"],
                     "path": connection_info["path"],
+                    # relation values are JSON decoded, e.g. the API version
+                    **{
+                        key: str(connection_info[key])
+                        for key in S3_OPTIONAL_FIELDS
+                        if connection_info.get(key) is not None
+                    },
+                    "tls-ca-chain": "\n".join(connection_info.get("tls-ca-chain") or []),
                 }
             except KeyError:
                 raise S3IntegrationNotReadyError()
@@ -563,6 +927,28 @@ class MsmOperatorCharm(ops.CharmBase):
         else:
             event.fail(f"Failed to create user {username}")
 
+    def _on_get_api_stats_action(self, event: ops.ActionEvent):
+        """Handle the get-api-stats action.
+
+        Args:
+            event (ops.ActionEvent): Event from the framework
+        """
+        event.set_results(
+            {
+                "stats": json.dumps(self._api_stats.data, sort_keys=True),
+                "buckets": json.dumps(LATENCY_BUCKETS),
+            }
+        )
+        if event.params.get("reset", False):
+            self._api_stats.data.clear()
+
+    def _on_pre_commit(self, event: ops.PreCommitEvent) -> None:
+        """Persist the MSM API statistics and responses gathered during this hook."""
+        if (stats := json.dumps(self._api_stats.data)) != self._stored.api_stats:
+            self._stored.api_stats = stats
+        if (cache := json.dumps(self._api_cache.data)) != self._stored.api_cache:
+            self._stored.api_cache = cache
+
     def _create_operator_user(self) -> None:
         """Create an internal admin operator user. Store the credentials in a Juju secret."""
         username = f"{self.app.name}-operator"
@@ -630,44 +1016,202 @@ class MsmOperatorCharm(ops.CharmBase):
             SiteManagerClient | None: Client instance if credentials are available, None otherwise
         """
         if creds_id := self.get_peer_data(self.app, MSM_CREDS_ID):
-            creds = self.model.get_secret(id=creds_id).get_content(refresh=True)
+            secret = self.model.get_secret(id=creds_id)
+            creds = secret.get_content(refresh=True)
             return SiteManagerClient(
                 username=creds["username"],
                 password=creds["password"],
                 url=f"http://localhost:{SERVICE_PORT}",
+                access_token=creds.get(MSM_ACCESS_TOKEN_KEY),
+                on_login=functools.partial(self._save_access_token, secret),
+                deadline=self._dispatch_started + HOOK_API_BUDGET,
+                circuit_breaker=CircuitBreaker(
+                    state=dict(self._stored.api_circuit), on_change=self._save_circuit_state
+                ),
+                stats=self._api_stats,
+                cache=self._api_cache,
             )
         return None
 
+    def _save_circuit_state(self, state: dict[str, Any]) -> None:
+        """Keep the API circuit breaker state across hooks."""
+        self._stored.api_circuit = state
+
+    def _save_access_token(self, secret: ops.Secret, token: str) -> None:
+        """Cache the operator access token in the credentials secret.
+
+        This lets later hooks reuse the token instead of logging in again.
+        Only the leader owns the secret, other units keep the token in memory.
+        The secret is only updated when the token changed, as every update
+        creates a new revision.
+        """
+        if not self.unit.is_leader():
+            return
+        content = secret.get_content()
+        if content.get(MSM_ACCESS_TOKEN_KEY) == token:
+            return
+        content[MSM_ACCESS_TOKEN_KEY] = token
+        secret.set_content(content)
+
+    def _on_secret_remove(self, event: ops.SecretRemoveEvent) -> None:
+        """Drop secret revisions no longer tracked by any observer."""
+        if event.secret.label in (MSM_CREDS_SECRET, MSM_ENROLL_TOKEN_POOL_SECRET):
+            event.remove_revision()
+
     def _update_ca_certificates(self) -> None:
         """Update CA certificates in the container."""
         self.container.exec(["update-ca-certificates", "--fresh"]).wait()
 
+    def _get_enroll_token_pool(self) -> tuple[ops.Secret | None, list[tuple[str, float]]]:
+        """Fetch the pooled enrollment tokens that are still usable.
+
+        Returns:
+            tuple[ops.Secret | None, list[tuple[str, float]]]: pool secret, if any,
+                and the pooled tokens with their expiry timestamp
+        """
+        try:
+            secret = self.model.get_secret(label=MSM_ENROLL_TOKEN_POOL_SECRET)
+        except ops.model.SecretNotFoundError:
+            return None, []
+        tokens = json.loads(secret.get_content(refresh=True).get("tokens", "[]"))
+        deadline = time.time() + ENROLL_TOKEN_MIN_TTL
+        return secret, [(token, expiry) for token, expiry in tokens if expiry > deadline]
+
+    def _set_enroll_token_pool(
+        self, secret: ops.Secret | None, tokens: list[tuple[str, float]]
+    ) -> None:
+        """Store the pooled enrollment tokens in a leader-owned secret.
+
+        Each update creates a secret revision, which is removed by
+        `_on_secret_remove` once it is no longer in use.
+        """
+        content = {"tokens": json.dumps(tokens)}
+        if secret:
+            secret.set_content(content)
+        else:
+            self.app.add_secret(content=content, label=MSM_ENROLL_TOKEN_POOL_SECRET)
+
+    def _enroll_token_demand(self) -> int:
+        """Count the enrollment relations still waiting for a token."""
+        return sum(
+            1
+            for relation in self.model.relations[enroll.DEFAULT_ENDPOINT_NAME]
+            if "token_id" not in relation.data[self.app]
+        )
+
     def _get_enroll_token(self) -> str | None:
-        """Create an enrollment token for a MAAS Site."""
-        if client := self._get_site_manager_client():
-            return client.issue_enroll_token()
-        return None
+        """Take an enrollment token for a MAAS Site from the token pool.
+
+        When the pool runs low, it is refilled with a single bulk request
+        sized to the relations waiting for a token, so that idle deployments
+        do not mint tokens that expire unused. Pooled tokens are still handed
+        out if the refill fails.
+
+        Raises:
+            ApiError: the pool is empty and could not be refilled
+            AuthError: the pool is empty and could not be refilled
+            RequestException: the pool is empty and could not be refilled
+        """
+        secret, tokens = self._get_enroll_token_pool()
+        demand = min(max(self._enroll_token_demand(), 1), ENROLL_TOKEN_POOL_SIZE)
+        if len(tokens) <= ENROLL_TOKEN_POOL_LOW_WATERMARK and len(tokens) < demand:
+            try:
+                if client := self._get_site_manager_client():
+                    with client:
+                        tokens.extend(client.issue_enroll_tokens(demand - len(tokens)))
+            except (RequestException, ApiError, AuthError) as ex:
+                if not tokens:
+                    raise
+                logger.warning("unable to refill the enrollment token pool: %s", ex)
+        if not tokens:
+            return None
+        token, _ = tokens.pop(0)
+        self._set_enroll_token_pool(secret, tokens)
+        return token
 
     def _on_maas_enroll_joined(self, event: ops.RelationEvent) -> None:
         """Set relation data for enrollment."""
         logger.info(event)
         if not self.unit.is_leader():
             return
-        if enroll_token := self._get_enroll_token():
+        try:
+            enroll_token = self._get_enroll_token()
+        except (RequestException, ApiError, AuthError) as ex:
+            logger.warning("deferring enrollment: %s", ex)
+            event.defer()
+            return
+        if enroll_token:
             self._enroll.publish_enroll_token(event.relation, enroll_token)
         else:
             event.defer()
 
+    def _on_image_cache_detaching(self, event: ops.StorageDetachingEvent) -> None:
+        """Stop using the image cache before its storage goes away."""
+        self._image_cache_detaching = True
+        self._reconcile(event)
+
+    def _on_update_status(self, event: ops.UpdateStatusEvent) -> None:
+        """Retry failed site removals and refresh the site count used for heartbeats."""
+        if not self.unit.is_leader():
+            return
+        if self.get_peer_data(self.app, MSM_PENDING_SITE_REMOVALS):
+            if client := self._get_site_manager_client():
+                self._remove_sites(client, [])
+        if str(self.model.config["heartbeat-mode"]).lower() != "adaptive":
+            return
+        if not (client := self._get_site_manager_client()):
+            return
+        try:
+            with client:
+                # not _site_count(), which includes the stored count and
+                # would never let it go down
+                count = max(
+                    client.count_sites(),
+                    len(self.model.relations[enroll.DEFAULT_ENDPOINT_NAME]),
+                )
+        except (RequestException, ApiError, AuthError) as ex:
+            logger.warning("unable to count sites: %s", ex)
+            return
+        # a count of 0 is stored as an empty peer data value
+        if count != (self.get_peer_data(self.app, MSM_SITE_COUNT) or 0):
+            self.set_peer_data(self.app, MSM_SITE_COUNT, count)
+            self._reconcile(event)
+
+    def _on_peer_relation_changed(self, event: ops.RelationChangedEvent) -> None:
+        """Follow site count updates made by the leader."""
+        if str(self.model.config["heartbeat-mode"]).lower() == "adaptive":
+            self._reconcile(event)
+
     def _on_maas_enroll_broken(self, event: ops.RelationEvent) -> None:
         """Handle a broken enrollment relation."""
         logger.info(event)
         if not self.unit.is_leader():
             return
         if client := self._get_site_manager_client():
-            return client.remove_site(event.relation.data[event.relation.app]["uuid"])
+            self._remove_sites(client, [event.relation.data[event.relation.app]["uuid"]])
         else:
             event.defer()
 
+    def _remove_sites(self, client: SiteManagerClient, cluster_ids: list[str]) -> None:
+        """Remove MAAS Sites, along with earlier removals that failed.
+
+        Sites that could not be removed are kept in the peer data and retried
+        on the next enrollment relation removal or update-status.
+        """
+        cluster_ids = (self.get_peer_data(self.app, MSM_PENDING_SITE_REMOVALS) or []) + cluster_ids
+        try:
+            with client:
+                results = client.remove_sites(cluster_ids)
+        except (RequestException, ApiError, AuthError) as ex:
+            logger.warning("postponing site removal: %s", ex)
+            results = dict.fromkeys(cluster_ids, SiteRemoval.FAILED)
+        failed = [
+            cluster_id for cluster_id, result in results.items() if result == SiteRemoval.FAILED
+        ]
+        if failed:
+            logger.warning("failed to remove sites, will retry later: %s", failed)
+        self.set_peer_data(self.app, MSM_PENDING_SITE_REMOVALS, failed)
+
 
 if __name__ == "__main__":  # pragma: nocover
     ops.main(MsmOperatorCharm)  # type: ignore
@@ -0,0 +1,276 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Typed schema for the MAAS Site Manager workload tuning settings."""
+
+import dataclasses
+import hashlib
+import json
+import math
+from collections.abc import Mapping
+from typing import Any
+
+import yaml
+
+KIB = 1024
+MIB = 1024 * KIB
+HEARTBEAT_MODES = ["static", "adaptive"]
+CACHE_EVICTION_POLICIES = ["lru", "lfu", "fifo"]
+DEFAULT_HEARTBEAT_INTERVAL = 300
+DEFAULT_CONN_LOST_THRESHOLD = 600
+# connections kept free for administration and other database clients
+DB_RESERVED_CONNECTIONS = 10
+DB_POOL_SIZE_MAX = 20
+DB_POOL_TIMEOUT = 30
+# version of the Tuning layout, to bump whenever its fields or their meaning
+# change so that settings cached by an older charm revision are parsed again
+SCHEMA_VERSION = 1
+
+
+class TuningError(ValueError):
+    """Signals that a tuning setting is invalid."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Setting:
+    """A numeric setting with its accepted range.
+
+    Attributes:
+        name: environment variable or charm option name
+        minimum: smallest accepted value
+        maximum: largest accepted value
+        unit: unit of the value, used in error messages
+        default: value used by the workload when the setting is not given
+    """
+
+    name: str
+    minimum: int
+    maximum: int
+    unit: str
+    default: int | None = None
+
+    def validate(self, value: Any) -> int:
+        """Check the value type and range.
+
+        Raises:
+            TuningError: value is not an integer within range
+
+        Returns:
+            int: the validated value
+        """
+        if isinstance(value, bool) or not isinstance(value, int | str):
+            raise TuningError(f"{self.name} must be an integer, got '{value}'")
+        try:
+            number = int(value)
+        except ValueError:
+            raise TuningError(f"{self.name} must be an integer, got '{value}'") from None
+        if not self.minimum <= number <= self.maximum:
+            raise TuningError(
+                f"{self.name} must be between {self.minimum} and {self.maximum} "
+                f"{self.unit}, got {number}"
+            )
+        return number
+
+
+# settings accepted in the `environment` charm option
+ENVIRONMENT_SETTINGS = {
+    setting.name: setting
+    for setting in (
+        Setting("MSM_CONN_LOST_THRESHOLD_SEC", 30, 86400, "seconds", DEFAULT_CONN_LOST_THRESHOLD),
+        Setting("MSM_HEARTBEAT_INTERVAL_SEC", 10, 86400, "seconds", DEFAULT_HEARTBEAT_INTERVAL),
+        Setting("MSM_METRICS_REFRESH_INTERVAL_SEC", 10, 86400, "seconds", 300),
+        Setting("MSM_IMAGE_SERVING_CHUNK_SIZE_BYTES", 64 * KIB, 256 * MIB, "bytes", 5 * MIB),
+        Setting("MSM_DB_POOL_SIZE", 1, 1000, "connections"),
+        Setting("MSM_DB_MAX_OVERFLOW", 0, 1000, "connections"),
+        Setting("MSM_DB_POOL_TIMEOUT_SEC", 1, 3600, "seconds"),
+    )
+}
+
+# numeric charm options
+OPTION_SETTINGS = {
+    setting.name: setting
+    for setting in (
+        Setting("backlog", 1, 65535, "connections"),
+        Setting("limit-concurrency", 0, 1_000_000, "connections"),
+        Setting("timeout-keep-alive", 1, 3600, "seconds"),
+        Setting("h11-max-incomplete-event-size", KIB, 16 * MIB, "bytes"),
+        Setting("limit-max-requests", 0, 100_000_000, "requests"),
+        Setting("max-requests", 0, 100_000_000, "requests"),
+        Setting("max-requests-jitter", 0, 100_000_000, "requests"),
+        Setting("graceful-timeout", 0, 3600, "seconds"),
+        Setting("heartbeat-rate-budget", 1, 100_000, "requests per second"),
+        # S3 rejects presigned URLs valid for more than 7 days
+        Setting("image-presign-ttl", 60, 604800, "seconds"),
+        Setting("image-cache-max-size", 1, 16 * MIB, "MiB"),
+        # S3 multipart parts are between 5 MiB and 5 GiB
+        Setting("s3-multipart-part-size", 5, 5 * KIB, "MiB"),
+        Setting("s3-max-concurrency", 1, 64, "transfers"),
+        Setting("db-max-connections", DB_RESERVED_CONNECTIONS + 1, 100_000, "connections"),
+    )
+}
+
+WORKERS = Setting("workers", 1, 256, "processes")
+
+
+@dataclasses.dataclass(frozen=True)
+class Tuning:
+    """Validated tuning settings.
+
+    Attributes:
+        environment: workload environment variables from the `environment` option
+        options: numeric charm options
+        workers: number of server processes, None to size them automatically
+        heartbeat_mode: whether heartbeat intervals are static or scaled with the fleet
+        cache_eviction_policy: order in which cached images are evicted
+    """
+
+    environment: dict[str, int]
+    options: dict[str, int]
+    workers: int | None
+    heartbeat_mode: str
+    cache_eviction_policy: str
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return a representation suitable for StoredState."""
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "Tuning":
+        """Rebuild the settings from `to_dict` output."""
+        return cls(
+            environment=dict(data["environment"]),
+            options=dict(data["options"]),
+            workers=data["workers"],
+            heartbeat_mode=data["heartbeat_mode"],
+            cache_eviction_policy=data["cache_eviction_policy"],
+        )
+
+    def heartbeat(self, sites: int) -> tuple[int, int]:
+        """Heartbeat interval and connection-lost threshold for a fleet.
+
+        In adaptive mode the configured interval is doubled until the heartbeats
+        of all sites fit in the rate budget. Quantizing to powers of two keeps
+        the interval, and so the workload configuration, stable while the fleet
+        grows. The threshold keeps its ratio to the interval.
+
+        Args:
+            sites (int): number of sites sending heartbeats
+
+        Returns:
+            tuple[int, int]: interval and threshold, in seconds
+        """
+        interval_setting = ENVIRONMENT_SETTINGS["MSM_HEARTBEAT_INTERVAL_SEC"]
+        threshold_setting = ENVIRONMENT_SETTINGS["MSM_CONN_LOST_THRESHOLD_SEC"]
+        base = self.environment.get(interval_setting.name, DEFAULT_HEARTBEAT_INTERVAL)
+        base_threshold = self.environment.get(threshold_setting.name, DEFAULT_CONN_LOST_THRESHOLD)
+        interval = base
+        if self.heartbeat_mode == "adaptive":
+            budget = self.options["heartbeat-rate-budget"]
+            while (
+                sites / interval > budget
+                and interval * 2 <= interval_setting.maximum
+                and base_threshold * interval * 2 / base <= threshold_setting.maximum
+            ):
+                interval *= 2
+        return interval, math.ceil(base_threshold * interval / base)
+
+
+def db_pool(max_connections: int, processes: int) -> dict[str, int]:
+    """Size the database connection pool of each server process.
+
+    The connections allowed by the database, minus a reserve, are shared
+    evenly between the processes of all units. Each process keeps up to half
+    of its share open and may overflow into the rest.
+
+    Args:
+        max_connections (int): connections accepted by the database
+        processes (int): server processes across all units
+
+    Raises:
+        TuningError: the database cannot give every process a connection
+
+    Returns:
+        dict[str, int]: pool size, maximum overflow and timeout in seconds
+    """
+    share = (max_connections - DB_RESERVED_CONNECTIONS) // max(processes, 1)
+    if share < 1:
+        raise TuningError(
+            f"db-max-connections ({max_connections}) is too low for {processes} server processes"
+        )
+    pool_size = min(max(share // 2, 1), DB_POOL_SIZE_MAX)
+    return {"size": pool_size, "max_overflow": share - pool_size, "timeout": DB_POOL_TIMEOUT}
+
+
+def config_hash(config: Mapping[str, Any]) -> str:
+    """Return a digest of the charm configuration and of the tuning schema version."""
+    payload = {"schema": SCHEMA_VERSION, "config": dict(config)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def parse_environment(raw: str) -> dict[str, int]:
+    """Parse and validate the `environment` charm option.
+
+    Args:
+        raw (str): YAML list of mappings with "name" and "value" keys
+
+    Raises:
+        TuningError: the option is malformed or a setting is invalid
+
+    Returns:
+        dict[str, int]: validated settings by environment variable name
+    """
+    try:
+        items = yaml.safe_load(raw)
+    except yaml.YAMLError:
+        raise TuningError("Failed to parse environment configuration.") from None
+    if items is None:
+        return {}
+    if not isinstance(items, list):
+        raise TuningError("Environment configuration must be in YAML format as a list.")
+    environment = {}
+    for item in items:
+        if not isinstance(item, dict) or not {"name", "value"} <= item.keys():
+            raise TuningError("Environment entries must have a name and a value.")
+        if (setting := ENVIRONMENT_SETTINGS.get(item["name"])) is None:
+            raise TuningError(f"Invalid environment variable: {item['name']}")
+        environment[setting.name] = setting.validate(item["value"])
+
+    heartbeat = ENVIRONMENT_SETTINGS["MSM_HEARTBEAT_INTERVAL_SEC"]
+    conn_lost = ENVIRONMENT_SETTINGS["MSM_CONN_LOST_THRESHOLD_SEC"]
+    if environment.get(conn_lost.name, conn_lost.default) <= environment.get(
+        heartbeat.name, heartbeat.default
+    ):
+        raise TuningError(f"{conn_lost.name} must be greater than {heartbeat.name}")
+    return environment
+
+
+def parse(config: Mapping[str, Any]) -> Tuning:
+    """Validate the tuning settings in the charm configuration.
+
+    Raises:
+        TuningError: a setting is invalid
+
+    Returns:
+        Tuning: validated settings
+    """
+    workers = str(config["workers"]).strip().lower()
+    heartbeat_mode = str(config["heartbeat-mode"]).lower()
+    if heartbeat_mode not in HEARTBEAT_MODES:
+        raise TuningError(
+            f"heartbeat-mode must be one of {', '.join(HEARTBEAT_MODES)}, got '{heartbeat_mode}'"
+        )
+    eviction_policy = str(config["image-cache-eviction-policy"]).lower()
+    if eviction_policy not in CACHE_EVICTION_POLICIES:
+        raise TuningError(
+            f"image-cache-eviction-policy must be one of {', '.join(CACHE_EVICTION_POLICIES)},"
+            f" got '{eviction_policy}'"
+        )
+    return Tuning(
+        environment=parse_environment(str(config.get("environment") or "[]")),
+        options={
+            name: setting.validate(config[name]) for name, setting in OPTION_SETTINGS.items()
+        },
+        workers=None if workers == "auto" else WORKERS.validate(workers),
+        heartbeat_mode=heartbeat_mode,
+        cache_eviction_policy=eviction_policy,
+    )
@@ -0,0 +1,65 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import os
+import time
+
+import pytest
+from fake_msm import FakeSiteManager
+
+LATENCY = float(os.environ.get("BENCHMARK_LATENCY_MS", "0")) / 1000
+
+RESULTS: list[dict] = []
+
+
+@pytest.fixture
+def fake_msm():
+    server = FakeSiteManager(latency=LATENCY).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def measure(fake_msm):
+    """Measure API calls, wall time and bytes transferred by a benchmark step."""
+
+    class Measure:
+        def __init__(self, name: str, size: int):
+            self.name = name
+            self.size = size
+
+        def __enter__(self):
+            fake_msm.reset_counters()
+            self.start = time.perf_counter()
+            return self
+
+        def __exit__(self, *args):
+            elapsed = time.perf_counter() - self.start
+            RESULTS.append(
+                {
+                    "name": self.name,
+                    "size": self.size,
+                    "calls": sum(fake_msm.calls.values()),
+                    "seconds": elapsed,
+                    "bytes": fake_msm.bytes_sent + fake_msm.bytes_received,
+                    "endpoints": dict(fake_msm.calls),
+                }
+            )
+
+    return Measure
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    terminalreporter.section("enrolment benchmark")
+    terminalreporter.write_line(f"latency per request: {LATENCY * 1000:.1f} ms")
+    terminalreporter.write_line(
+        f"{'benchmark':<28} {'N':>6} {'calls':>7} {'wall (s)':>10} {'ms/site':>9} {'bytes':>11}"
+    )
+    for result in RESULTS:
+        terminalreporter.write_line(
+            f"{result['name']:<28} {result['size']:>6} {result['calls']:>7} "
+            f"{result['seconds']:>10.3f} {result['seconds'] * 1000 / result['size']:>9.2f} "
+            f"{result['bytes']:>11}"
+        )
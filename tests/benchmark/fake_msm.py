@@ -0,0 +1,186 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""In-process stand-in for the MAAS Site Manager API.
+
+Only the endpoints used by the charm are implemented: login, tokens and
+the active/pending site listings, which carry an ETag and honour
+If-None-Match. Every request can be delayed to mimic network and server
+latency, and the server counts calls and bytes per endpoint.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from api import endpoint_name
+
+
+def make_jwt(claims: dict) -> str:
+    """Encode an unsigned JWT."""
+
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    return f"{encode({'alg': 'none'})}.{encode(claims)}."
+
+
+class _Server(ThreadingHTTPServer):
+    fake: "FakeSiteManager"
+
+
+class FakeSiteManager:
+    """Fake MSM API server running in a background thread."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        token_ttl: int = 3600,
+        filter_pending: bool = False,
+    ) -> None:
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.filter_pending = filter_pending
+        self.sites: dict[str, dict] = {}
+        self.pending: dict[str, dict] = {}
+        self.tokens: list[str] = []
+        self.calls: Counter[str] = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "FakeSiteManager":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def add_sites(self, cluster_ids: list[str], pending: bool = True) -> None:
+        """Populate the dataset with one site per cluster ID."""
+        target = self.pending if pending else self.sites
+        for cluster_id in cluster_ids:
+            site_id = str(uuid.uuid4())
+            target[site_id] = {"id": site_id, "cluster_id": cluster_id, "name": cluster_id}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    @property
+    def fake(self) -> FakeSiteManager:
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict | None = None, etag: bool = False) -> None:
+        payload = json.dumps(body).encode() if body is not None else b""
+        tag = f'"{hashlib.sha256(payload).hexdigest()[:16]}"' if etag else None
+        if tag and self.headers.get("If-None-Match") == tag:
+            status, payload = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if tag:
+            self.send_header("ETag", tag)
+        self.end_headers()
+        self.wfile.write(payload)
+        with self.fake._lock:
+            self.fake.bytes_sent += len(payload)
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.fake._lock:
+            self.fake.bytes_received += len(body)
+        return body
+
+    def _authorized(self) -> bool:
+        auth = self.headers.get("Authorization", "")
+        if auth.removeprefix("Bearer ") in self.fake.tokens:
+            return True
+        self._reply(401, {"detail": "Not authenticated"})
+        return False
+
+    def _dispatch(self, method: str) -> None:
+        with self.fake._lock:
+            self.fake.calls[endpoint_name(method, self.path)] += 1
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        url = urlparse(self.path)
+        body = self._read_body()
+        if method == "post" and url.path == "/api/v1/login":
+            token = make_jwt({"sub": "operator", "exp": time.time() + self.fake.token_ttl})
+            self.fake.tokens.append(token)
+            return self._reply(200, {"access_token": token, "token_type": "bearer"})
+        if not self._authorized():
+            return
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if method == "post" and url.path == "/api/v1/tokens":
+            return self._issue_tokens(json.loads(body))
+        if method == "get" and url.path in ("/api/v1/sites", "/api/v1/sites/pending"):
+            return self._list_sites(url.path.endswith("pending"), query)
+        if method == "delete" and url.path.startswith("/api/v1/sites/"):
+            return self._delete_site(url.path.rsplit("/", 1)[1])
+        self._reply(404, {"detail": "Not Found"})
+
+    def _issue_tokens(self, request: dict) -> None:
+        expired = time.time() + request["duration"]
+        items = [
+            {"id": i, "value": make_jwt({"jti": str(uuid.uuid4()), "exp": expired})}
+            for i in range(request["count"])
+        ]
+        self._reply(200, {"items": items})
+
+    def _list_sites(self, pending: bool, query: dict) -> None:
+        sites = list((self.fake.pending if pending else self.fake.sites).values())
+        if "cluster_id" in query and (not pending or self.fake.filter_pending):
+            sites = [s for s in sites if s["cluster_id"] == query["cluster_id"]]
+        page, size = int(query.get("page", 1)), int(query.get("size", 20))
+        items = sites[(page - 1) * size : page * size]
+        self._reply(200, {"items": items, "total": len(sites), "page": page}, etag=True)
+
+    def _delete_site(self, site_id: str) -> None:
+        with self.fake._lock:
+            found = self.fake.sites.pop(site_id, None) or self.fake.pending.pop(site_id, None)
+        if found:
+            self._reply(204)
+        else:
+            self._reply(404, {"detail": "Site not found"})
+
+    def do_GET(self):
+        self._dispatch("get")
+
+    def do_POST(self):
+        self._dispatch("post")
+
+    def do_DELETE(self):
+        self._dispatch("delete")
@@ -0,0 +1,90 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Run with `tox -e benchmark`. Sizes and per-request latency can be tuned
+# with the BENCHMARK_SIZES and BENCHMARK_LATENCY_MS environment variables.
+
+import os
+import unittest.mock
+import uuid
+
+import ops
+import ops.testing
+import pytest
+from charms.maas_site_manager_k8s.v0 import enroll
+
+from api import SiteManagerClient, SiteRemoval
+from charm import MSM_CREDS_ID, MSM_PEER_NAME, MsmOperatorCharm
+
+SIZES = [int(n) for n in os.environ.get("BENCHMARK_SIZES", "1,10,100,1000").split(",")]
+
+
+@pytest.fixture
+def client(fake_msm):
+    with SiteManagerClient("operator", "secret", fake_msm.url) as client:
+        yield client
+
+
+@pytest.fixture
+def harness(fake_msm):
+    harness = ops.testing.Harness(MsmOperatorCharm)
+    harness.set_model_name("msm-benchmark")
+    harness.set_leader(True)
+    with (
+        unittest.mock.patch("charm.SERVICE_PORT", fake_msm.port),
+        unittest.mock.patch("charm.HOOK_API_BUDGET", 3600),
+    ):
+        harness.begin()
+        app = harness.charm.app
+        rel_id = harness.add_relation(MSM_PEER_NAME, app.name)
+        secret = app.add_secret({"username": "operator", "password": "secret"})
+        harness.update_relation_data(rel_id, app.name, {MSM_CREDS_ID: f'"{secret.id}"'})
+        yield harness
+    harness.cleanup()
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_client_issue_enroll_token(size, client, measure):
+    with measure("client.issue_enroll_token", size):
+        tokens = [client.issue_enroll_token() for _ in range(size)]
+    assert len(set(tokens)) == size
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_client_remove_site(size, client, fake_msm, measure):
+    cluster_ids = [str(uuid.uuid4()) for _ in range(size)]
+    fake_msm.add_sites(cluster_ids)
+    with measure("client.remove_site", size):
+        for cluster_id in cluster_ids:
+            client.remove_site(cluster_id)
+    assert not fake_msm.pending
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_client_remove_sites(size, client, fake_msm, measure):
+    cluster_ids = [str(uuid.uuid4()) for _ in range(size)]
+    fake_msm.add_sites(cluster_ids)
+    with measure("client.remove_sites", size):
+        results = client.remove_sites(cluster_ids)
+    assert set(results.values()) == {SiteRemoval.REMOVED}
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_charm_enroll_joined_broken(size, harness, fake_msm, measure):
+    cluster_ids = [str(uuid.uuid4()) for _ in range(size)]
+    fake_msm.add_sites(cluster_ids)
+
+    with measure("charm._on_maas_enroll_joined", size):
+        rel_ids = [
+            harness.add_relation(
+                enroll.DEFAULT_ENDPOINT_NAME, f"maas-{i}", app_data={"uuid": cluster_id}
+            )
+            for i, cluster_id in enumerate(cluster_ids)
+        ]
+    for rel_id in rel_ids:
+        assert "token_id" in harness.get_relation_data(rel_id, harness.charm.app)
+
+    with measure("charm._on_maas_enroll_broken", size):
+        for rel_id in rel_ids:
+            harness.remove_relation(rel_id)
+    assert not fake_msm.pending
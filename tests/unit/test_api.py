@@ -1,50 +1,187 @@
+import base64
+import json
+import threading
+import time
 import unittest
 import uuid
 from unittest.mock import ANY, Mock, patch
 
-from api import AuthError, SiteManagerClient
+import requests
+
+from api import (
+    LATENCY_BUCKETS,
+    ApiError,
+    ApiStats,
+    AsyncSiteManagerClient,
+    AuthError,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    ResponseCache,
+    SiteManagerClient,
+    SiteRemoval,
+    endpoint_name,
+    jwt_expiry,
+    run_batch,
+)
+
+
+def response(
+    body: dict | None = None, status_code: int = 200, headers: dict | None = None
+) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    resp._content = json.dumps(body or {}).encode()
+    return resp
+
+
+def make_jwt(exp: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).rstrip(b"=")
+    return f"header.{payload.decode()}.signature"
 
 
 class TestSiteManagerClient(unittest.TestCase):
     def setUp(self):
         self.client = SiteManagerClient("username", "password", "http://localhost")
+        self.addCleanup(self.client.close)
 
-    @patch("charm.requests.post")
-    def test_login(self, mock_post):
-        result = result = Mock(
-            **{
-                "json.return_value": {"access_token": "token"},
-                "ok": True,
-                "status_code": 200,
-            }
+    def test_session_pool(self):
+        client = SiteManagerClient("username", "password", "http://localhost", pool_size=4)
+        adapter = client._session.get_adapter("http://localhost")
+        assert adapter._pool_maxsize == 4
+        # retries are made by the client, within the deadline
+        assert adapter.max_retries.total == 0
+        client.close()
+
+    @patch("api.time.sleep")
+    @patch("api.requests.Session.get")
+    def test_retry(self, mock_get, mock_sleep):
+        mock_get.side_effect = [
+            requests.ConnectionError(),
+            response(status_code=503),
+            response({"items": []}),
+        ]
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", access_token=make_jwt(time.time() + 3600)
+        )
+
+        assert client._request("get", "/api/v1/sites").ok
+        assert mock_get.call_count == 3
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [0.3, 0.6]
+        client.close()
+
+    @patch("api.time.sleep")
+    @patch("api.requests.Session.get")
+    def test_retry_within_deadline(self, mock_get, mock_sleep):
+        mock_get.return_value = response(status_code=503)
+        client = SiteManagerClient(
+            "username",
+            "password",
+            "http://localhost",
+            access_token=make_jwt(time.time() + 3600),
+            backoff_factor=10,
+            deadline=time.monotonic() + 15,
         )
+
+        assert client._request("get", "/api/v1/sites").status_code == 503
+        # the second backoff would overrun the deadline
+        assert mock_get.call_count == 2
+        mock_sleep.assert_called_once_with(10)
+        client.close()
+
+    @patch("api.requests.Session.post")
+    def test_no_retry_post(self, mock_post):
+        mock_post.return_value = response(status_code=503)
+
+        with self.assertRaises(AuthError):
+            self.client._login()
+        mock_post.assert_called_once()
+
+    @patch("api.requests.Session.post")
+    def test_session_reused(self, mock_post):
+        mock_post.return_value = response({"access_token": "token"})
+        session = self.client._session
+
+        self.client._login()
+        self.client._login()
+
+        assert self.client._session is session
+        assert mock_post.call_count == 2
+
+    @patch("api.requests.Session.post")
+    def test_login(self, mock_post):
+        result = response({"access_token": "token"})
         mock_post.return_value = result
 
         assert self.client._login() == {"Authorization": "Bearer token"}
 
-    @patch("charm.requests.post")
-    def test_login_failed(self, mock_post):
-        result = Mock(
-            **{
-                "json.return_value": {"error": {}},
-                "ok": False,
-            }
+    def test_jwt_expiry(self):
+        assert jwt_expiry(make_jwt(1234)) == 1234
+        assert jwt_expiry("not-a-jwt") is None
+
+    @patch("api.requests.Session.post")
+    def test_login_cached_token(self, mock_post):
+        token = make_jwt(time.time() + 3600)
+        client = SiteManagerClient("username", "password", "http://localhost", access_token=token)
+
+        assert client._login() == {"Authorization": f"Bearer {token}"}
+        mock_post.assert_not_called()
+        client.close()
+
+    @patch("api.requests.Session.post")
+    def test_login_expired_token(self, mock_post):
+        new_token = make_jwt(time.time() + 3600)
+        mock_post.return_value = response({"access_token": new_token})
+        on_login = Mock()
+        client = SiteManagerClient(
+            "username",
+            "password",
+            "http://localhost",
+            access_token=make_jwt(time.time() + 10),
+            on_login=on_login,
+        )
+
+        assert client._login() == {"Authorization": f"Bearer {new_token}"}
+        mock_post.assert_called_once()
+        on_login.assert_called_once_with(new_token)
+        assert client.access_token == new_token
+        client.close()
+
+    @patch("api.requests.Session.post")
+    @patch("api.requests.Session.get")
+    def test_request_relogin_on_unauthorized(self, mock_get, mock_post):
+        new_token = make_jwt(time.time() + 3600)
+        mock_post.return_value = response({"access_token": new_token})
+        mock_get.side_effect = [response(status_code=401), response()]
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", access_token=make_jwt(time.time() + 3600)
+        )
+
+        resp = client._request("get", "/api/v1/sites")
+
+        assert resp.status_code == 200
+        mock_post.assert_called_once()
+        mock_get.assert_called_with(
+            "http://localhost/api/v1/sites",
+            headers={"Authorization": f"Bearer {new_token}"},
+            timeout=(3.05, 10.0),
         )
+        client.close()
+
+    @patch("api.requests.Session.post")
+    def test_login_failed(self, mock_post):
+        result = response({"error": {}}, status_code=400)
         mock_post.return_value = result
         with self.assertRaises(AuthError):
             self.client._login()
 
-    @patch("charm.SiteManagerClient._login")
-    @patch("charm.requests.post")
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.post")
     def test_issue_enroll_token(self, mock_tokens, mock_login):
         mock_login.return_value = "token"
 
-        result = Mock(
-            **{
-                "json.return_value": {"items": [{"value": "enroll_token"}]},
-                "ok": True,
-            }
-        )
+        result = response({"items": [{"value": "enroll_token"}]})
         mock_tokens.return_value = result
 
         token = self.client.issue_enroll_token()
@@ -53,60 +190,553 @@ class TestSiteManagerClient(unittest.TestCase):
         mock_tokens.assert_called_once()
         assert token == "enroll_token"
 
-    @patch("charm.SiteManagerClient._login")
-    @patch("charm.requests.get")
-    @patch("charm.requests.delete")
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.post")
+    def test_issue_enroll_tokens(self, mock_tokens, mock_login):
+        expiry = time.time() + 600
+        mock_tokens.return_value = response(
+            {"items": [{"value": make_jwt(expiry)}, {"value": "opaque"}]}
+        )
+
+        tokens = self.client.issue_enroll_tokens(2, duration=1800)
+
+        mock_tokens.assert_called_once_with(
+            "http://localhost/api/v1/tokens",
+            json={"count": 2, "duration": 1800},
+            headers=ANY,
+            timeout=ANY,
+        )
+        assert tokens[0] == (make_jwt(expiry), expiry)
+        assert tokens[1][0] == "opaque"
+        assert tokens[1][1] >= time.time() + 1700
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    @patch("api.requests.Session.delete")
     def test_remove_site(self, mock_delete, mock_sites, mock_login):
         cluster_id = str(uuid.uuid4())
         mock_login.return_value = "token"
 
-        sites = Mock(
-            **{
-                "json.return_value": {"items": [{"id": "site_1"}]},
-                "ok": True,
-            }
-        )
+        sites = response({"items": [{"id": "site_1"}]})
         mock_sites.return_value = sites
+        mock_delete.return_value = response(status_code=204)
 
         self.client.remove_site(cluster_id)
 
-        mock_login.assert_called_once()
+        mock_login.assert_called()
         mock_sites.assert_called_once_with(
-            "http://localhost/api/v1/sites", params={"cluster_id": cluster_id}, headers=ANY
+            "http://localhost/api/v1/sites",
+            params={"cluster_id": cluster_id, "page": 1, "size": 100},
+            headers=ANY,
+            timeout=ANY,
+        )
+        mock_delete.assert_called_once_with(
+            "http://localhost/api/v1/sites/site_1", headers=ANY, timeout=ANY
         )
-        mock_delete.assert_called_once_with("http://localhost/api/v1/sites/site_1", headers=ANY)
 
-    @patch("charm.SiteManagerClient._login")
-    @patch("charm.requests.get")
-    @patch("charm.requests.delete")
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    @patch("api.requests.Session.delete")
     def test_remove_site_pending(self, mock_delete, mock_sites, mock_login):
         cluster_id = str(uuid.uuid4())
         mock_login.return_value = "token"
 
-        no_sites = Mock(
-            **{
-                "json.return_value": {"items": []},
-                "ok": True,
+        no_sites = response({"items": []})
+        pending_sites = response(
+            {
+                "items": [
+                    {"id": "pending_1", "cluster_id": str(uuid.uuid4())},
+                    {"id": "pending_2", "cluster_id": cluster_id},
+                ]
             }
         )
-        pending_sites = Mock(
-            **{
-                "json.return_value": {
+        mock_sites.side_effect = [no_sites, pending_sites]
+        mock_delete.return_value = response(status_code=204)
+
+        self.client.remove_site(cluster_id)
+
+        mock_login.assert_called()
+        mock_sites.assert_any_call(
+            "http://localhost/api/v1/sites",
+            params={"cluster_id": cluster_id, "page": 1, "size": 100},
+            headers=ANY,
+            timeout=ANY,
+        )
+        mock_sites.assert_any_call(
+            "http://localhost/api/v1/sites/pending",
+            params={"cluster_id": cluster_id, "page": 1, "size": 100},
+            headers=ANY,
+            timeout=ANY,
+        )
+        mock_delete.assert_called_once_with(
+            "http://localhost/api/v1/sites/pending_2", headers=ANY, timeout=ANY
+        )
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_iter_items_pages(self, mock_get, mock_login):
+        mock_get.side_effect = [
+            response({"items": [{"id": 1}, {"id": 2}], "total": 3}),
+            response({"items": [{"id": 3}], "total": 3}),
+        ]
+
+        items = list(self.client.iter_items("/api/v1/sites", page_size=2))
+
+        assert items == [{"id": 1}, {"id": 2}, {"id": 3}]
+        mock_get.assert_called_with(
+            "http://localhost/api/v1/sites",
+            params={"page": 2, "size": 2},
+            headers=ANY,
+            timeout=ANY,
+        )
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_count_sites(self, mock_get, mock_login):
+        mock_get.return_value = response({"items": [{"id": 1}], "total": 1234})
+
+        assert self.client.count_sites() == 1234
+        mock_get.assert_called_once_with(
+            "http://localhost/api/v1/sites",
+            params={"page": 1, "size": 1},
+            headers=ANY,
+            timeout=ANY,
+        )
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_find_site_pending_pages(self, mock_get, mock_login):
+        cluster_id = str(uuid.uuid4())
+        pending = [{"id": f"pending_{i}", "cluster_id": str(uuid.uuid4())} for i in range(99)]
+        pending.append({"id": "pending_99", "cluster_id": cluster_id})
+        mock_get.side_effect = [
+            response({"items": [], "total": 0}),
+            response({"items": pending, "total": 150}),
+            response({"items": pending[:50], "total": 150}),
+        ]
+
+        assert self.client.find_site(cluster_id) == "pending_99"
+        assert mock_get.call_count == 3
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_find_site_pending_duplicates(self, mock_get, mock_login):
+        cluster_id = str(uuid.uuid4())
+        mock_get.side_effect = [
+            response({"items": []}),
+            response(
+                {
                     "items": [
-                        {"id": "pending_1", "cluster_id": str(uuid.uuid4())},
+                        {"id": "pending_1", "cluster_id": cluster_id},
                         {"id": "pending_2", "cluster_id": cluster_id},
                     ]
-                },
-                "ok": True,
-            }
+                }
+            ),
+        ]
+
+        with self.assertRaisesRegex(ApiError, "More than one pending sites"):
+            self.client.find_site(cluster_id)
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_find_site_pending_filtered(self, mock_get, mock_login):
+        cluster_id = str(uuid.uuid4())
+        site = {"id": "pending_1", "cluster_id": cluster_id}
+        mock_get.side_effect = [
+            response({"items": [], "total": 0}),
+            response({"items": [site], "total": 1}),
+        ]
+
+        assert self.client.find_site(cluster_id) == "pending_1"
+        assert mock_get.call_count == 2
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_find_site_pending_stops_at_duplicate(self, mock_get, mock_login):
+        cluster_id = str(uuid.uuid4())
+        others = [{"id": f"pending_{i}", "cluster_id": str(uuid.uuid4())} for i in range(99)]
+        mock_get.side_effect = [
+            response({"items": [], "total": 0}),
+            response({"items": [{"id": "a", "cluster_id": cluster_id}, *others], "total": 1000}),
+            response({"items": [*others, {"id": "b", "cluster_id": cluster_id}], "total": 1000}),
+        ]
+
+        with self.assertRaisesRegex(ApiError, "More than one pending sites"):
+            self.client.find_site(cluster_id)
+        assert mock_get.call_count == 3
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_find_site_pending_unfiltered_cached(self, mock_get, mock_login):
+        mock_login.return_value = {"Authorization": "Bearer token"}
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", cache=ResponseCache()
         )
-        mock_sites.side_effect = [no_sites, pending_sites]
+        self.addCleanup(client.close)
+        cluster_id = str(uuid.uuid4())
+        others = [{"id": f"pending_{i}", "cluster_id": str(uuid.uuid4())} for i in range(100)]
+        last_page = {"items": [{"id": "pending_100", "cluster_id": cluster_id}], "total": 101}
+        mock_get.side_effect = [
+            response({"items": []}),
+            response({"items": others, "total": 101}),
+            response(last_page, headers={"ETag": '"v2"'}),
+            response({"items": []}),
+            response({"items": others, "total": 101}, headers={"ETag": '"v1"'}),
+            response(status_code=304),
+        ]
 
-        self.client.remove_site(cluster_id)
+        assert client.find_site(cluster_id) == "pending_100"
+        # the filter is known to be ignored, the unfiltered listing is read directly
+        assert client.find_site(cluster_id) == "pending_100"
+        assert mock_get.call_count == 6
+        mock_get.assert_called_with(
+            "http://localhost/api/v1/sites/pending",
+            params={"page": 2, "size": 100},
+            headers={"Authorization": "Bearer token", "If-None-Match": '"v2"'},
+            timeout=ANY,
+        )
 
-        mock_login.assert_called_once()
-        mock_sites.assert_any_call(
-            "http://localhost/api/v1/sites", params={"cluster_id": cluster_id}, headers=ANY
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_iter_items_page_ignored(self, mock_get, mock_login):
+        mock_get.return_value = response({"items": [{"id": 1}, {"id": 2}]})
+
+        items = list(self.client.iter_items("/api/v1/sites", page_size=2))
+
+        assert items == [{"id": 1}, {"id": 2}]
+        assert mock_get.call_count == 2
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    @patch("api.requests.Session.delete")
+    def test_remove_sites(self, mock_delete, mock_get, mock_login):
+        mock_get.side_effect = [
+            response(
+                {
+                    "items": [
+                        {"id": "site_1", "cluster_id": "cluster_1"},
+                        {"id": "site_2", "cluster_id": "cluster_2"},
+                    ],
+                    "total": 2,
+                }
+            ),
+            response(
+                {
+                    "items": [{"id": "pending_3", "cluster_id": "cluster_3"}],
+                    "total": 1,
+                }
+            ),
+        ]
+
+        def delete(url, **kwargs):
+            return response(status_code=500 if url.endswith("site_2") else 204)
+
+        mock_delete.side_effect = delete
+
+        results = self.client.remove_sites(["cluster_1", "cluster_2", "cluster_3", "cluster_4"])
+
+        assert results == {
+            "cluster_1": SiteRemoval.REMOVED,
+            "cluster_2": SiteRemoval.FAILED,
+            "cluster_3": SiteRemoval.REMOVED,
+            "cluster_4": SiteRemoval.NOT_FOUND,
+        }
+        assert mock_get.call_count == 2
+        assert mock_delete.call_count == 3
+
+    @patch("api.requests.Session.post")
+    @patch("api.requests.Session.get")
+    @patch("api.requests.Session.delete")
+    def test_remove_sites_relogin_once(self, mock_delete, mock_get, mock_post):
+        old_token = make_jwt(time.time() + 3600)
+        new_token = make_jwt(time.time() + 3600)
+        mock_post.return_value = response({"access_token": new_token})
+        mock_get.return_value = response(
+            {"items": [{"id": f"site_{i}", "cluster_id": f"cluster_{i}"} for i in range(8)]}
+        )
+
+        def delete(url, headers, **kwargs):
+            rejected = headers["Authorization"] == f"Bearer {old_token}"
+            return response(status_code=401 if rejected else 204)
+
+        mock_delete.side_effect = delete
+        callback_threads = []
+
+        def callback(*args):
+            callback_threads.append(threading.current_thread())
+
+        client = SiteManagerClient(
+            "username",
+            "password",
+            "http://localhost",
+            access_token=old_token,
+            on_login=callback,
+            circuit_breaker=CircuitBreaker(state={"failures": 1}, on_change=callback),
+        )
+
+        results = client.remove_sites([f"cluster_{i}" for i in range(8)])
+
+        assert set(results.values()) == {SiteRemoval.REMOVED}
+        mock_post.assert_called_once()
+        assert callback_threads == [threading.main_thread()] * 2
+        client.close()
+
+    @patch("api.SiteManagerClient.find_site")
+    def test_index_sites_single(self, mock_find_site):
+        mock_find_site.return_value = "site_1"
+
+        assert self.client.index_sites(["cluster_1"]) == {"cluster_1": "site_1"}
+        mock_find_site.assert_called_once_with("cluster_1")
+
+    @patch("api.requests.Session.post")
+    def test_deadline_caps_timeout(self, mock_post):
+        mock_post.return_value = response({"access_token": "token"})
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", deadline=time.monotonic() + 2
+        )
+
+        client._login()
+
+        connect, read = mock_post.call_args.kwargs["timeout"]
+        assert connect <= 2
+        assert read <= 2
+        client.close()
+
+    @patch("api.requests.Session.post")
+    def test_deadline_exceeded(self, mock_post):
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", deadline=time.monotonic() - 1
+        )
+
+        with self.assertRaises(DeadlineExceededError):
+            client._login()
+        mock_post.assert_not_called()
+        client.close()
+
+    @patch("api.requests.Session.post")
+    def test_circuit_breaker_opens(self, mock_post):
+        mock_post.side_effect = requests.ConnectionError()
+        on_change = Mock()
+        breaker = CircuitBreaker(threshold=2, on_change=on_change)
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", circuit_breaker=breaker
+        )
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                client._login()
+        with self.assertRaises(CircuitOpenError):
+            client._login()
+
+        assert mock_post.call_count == 2
+        assert on_change.call_args.args[0]["failures"] == 2
+        client.close()
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    @patch("api.requests.Session.delete")
+    def test_stats(self, mock_delete, mock_get, mock_login):
+        stats = ApiStats()
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", retries=0, stats=stats
+        )
+        mock_get.return_value = response({"items": [{"id": 42}]})
+        mock_delete.side_effect = requests.ConnectionError()
+
+        with self.assertRaises(requests.ConnectionError):
+            client.remove_site("cluster_1")
+
+        sites = stats.data["GET /api/v1/sites"]
+        assert sites["count"] == 1
+        assert sites["errors"] == 0
+        assert sites["bytes"] == len(b'{"items": [{"id": 42}]}')
+        assert sum(sites["buckets"]) == 1
+        assert stats.data["DELETE /api/v1/sites/{id}"]["errors"] == 1
+        client.close()
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_iter_items_cached(self, mock_get, mock_login):
+        mock_login.return_value = {"Authorization": "Bearer token"}
+        client = SiteManagerClient(
+            "username", "password", "http://localhost", cache=ResponseCache()
+        )
+        self.addCleanup(client.close)
+        body = {"items": [{"id": 1}], "total": 1}
+        mock_get.side_effect = [
+            response(body, headers={"ETag": '"v1"'}),
+            response(status_code=304),
+        ]
+
+        assert list(client.iter_items("/api/v1/sites")) == [{"id": 1}]
+        assert list(client.iter_items("/api/v1/sites")) == [{"id": 1}]
+        mock_get.assert_called_with(
+            "http://localhost/api/v1/sites",
+            params={"page": 1, "size": 100},
+            headers={"Authorization": "Bearer token", "If-None-Match": '"v1"'},
+            timeout=ANY,
+        )
+
+    @patch("api.SiteManagerClient._login")
+    @patch("api.requests.Session.get")
+    def test_iter_items_not_cached_without_validator(self, mock_get, mock_login):
+        mock_login.return_value = {"Authorization": "Bearer token"}
+        cache = ResponseCache()
+        client = SiteManagerClient("username", "password", "http://localhost", cache=cache)
+        self.addCleanup(client.close)
+        mock_get.return_value = response({"items": [], "total": 0})
+
+        list(client.iter_items("/api/v1/sites"))
+
+        assert cache.get("http://localhost/api/v1/sites", {"page": 1, "size": 100}) is None
+        mock_get.assert_called_once_with(
+            "http://localhost/api/v1/sites",
+            params={"page": 1, "size": 100},
+            headers={"Authorization": "Bearer token"},
+            timeout=ANY,
         )
-        mock_sites.assert_any_call("http://localhost/api/v1/sites/pending", headers=ANY)
-        mock_delete.assert_called_once_with("http://localhost/api/v1/sites/pending_2", headers=ANY)
+
+
+class TestAsyncSiteManagerClient(unittest.TestCase):
+    def setUp(self):
+        self.sync_client = SiteManagerClient("username", "password", "http://localhost")
+        self.client = AsyncSiteManagerClient(self.sync_client)
+        self.addCleanup(self.client.close)
+
+    @patch("api.SiteManagerClient.delete_site")
+    def test_delete_sites_overlap(self, mock_delete):
+        mock_delete.side_effect = lambda site_id: time.sleep(0.2)
+
+        start = time.monotonic()
+        results = run_batch(self.client.delete_site(f"site_{i}") for i in range(4))
+
+        assert results == [None] * 4
+        assert time.monotonic() - start < 0.6
+
+    @patch("api.SiteManagerClient.find_site")
+    def test_run_batch_exceptions(self, mock_find):
+        mock_find.side_effect = ["site_1", ApiError("boom")]
+
+        results = run_batch(
+            [self.client.find_site("cluster_1"), self.client.find_site("cluster_2")]
+        )
+
+        assert results[0] == "site_1"
+        assert isinstance(results[1], ApiError)
+
+    @patch("api.SiteManagerClient._login")
+    def test_login_callback_deferred(self, mock_login):
+        on_login = Mock()
+        self.sync_client._on_login = on_login
+        self.sync_client._access_token = "token"
+        mock_login.side_effect = lambda: self.sync_client._logged_in() or {}
+
+        run_batch([self.client.login()])
+        on_login.assert_not_called()
+
+        self.client.close()
+        on_login.assert_called_once_with("token")
+
+    @patch("api.SiteManagerClient.close")
+    def test_close_keeps_client_open(self, mock_close):
+        self.client.close()
+
+        mock_close.assert_not_called()
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_filtered_listing_not_cached(self):
+        cache = ResponseCache()
+        params = {"cluster_id": "cluster_1", "page": 1, "size": 100}
+
+        cache.put("http://localhost/api/v1/sites", params, response(headers={"ETag": '"v1"'}))
+
+        assert cache.get("http://localhost/api/v1/sites", params) is None
+        assert cache.data == {}
+
+    def test_evict_oldest(self):
+        cache = ResponseCache(max_entries=2)
+        for page in (1, 2, 3):
+            cache.put(
+                "http://localhost/api/v1/sites",
+                {"page": page},
+                response({"page": page}, headers={"ETag": f'"{page}"'}),
+            )
+
+        assert cache.get("http://localhost/api/v1/sites", {"page": 1}) is None
+        assert cache.get("http://localhost/api/v1/sites", {"page": 3})["body"] == {"page": 3}
+        assert len(cache.data) == 2
+
+    def test_expired(self):
+        cache = ResponseCache(max_age=60)
+        cache.put("http://localhost/api/v1/sites", {}, response(headers={"ETag": '"v1"'}))
+        assert cache.get("http://localhost/api/v1/sites", {}) is not None
+
+        with patch("api.time.time", return_value=time.time() + 120):
+            assert cache.get("http://localhost/api/v1/sites", {}) is None
+
+
+class TestApiStats(unittest.TestCase):
+    def test_endpoint_name(self):
+        assert endpoint_name("get", "http://localhost/api/v1/sites") == "GET /api/v1/sites"
+        assert (
+            endpoint_name("delete", f"http://localhost/api/v1/sites/{uuid.uuid4()}")
+            == "DELETE /api/v1/sites/{id}"
+        )
+
+    def test_record(self):
+        stats = ApiStats()
+        stats.record("GET /", 0.001, 200, 10)
+        stats.record("GET /", 60, 404, 5)
+
+        entry = stats.data["GET /"]
+        assert entry["count"] == 2
+        assert entry["errors"] == 1
+        assert entry["bytes"] == 15
+        assert entry["buckets"][0] == 1
+        assert entry["buckets"][len(LATENCY_BUCKETS)] == 1
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_reset_after_timeout(self):
+        breaker = CircuitBreaker(
+            threshold=1, reset_timeout=60, state={"failures": 1, "opened_at": time.time() - 61}
+        )
+
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == {"failures": 0, "opened_at": None}
+
+    def test_half_open_single_trial(self):
+        breaker = CircuitBreaker(
+            threshold=1, reset_timeout=60, state={"failures": 1, "opened_at": time.time() - 61}
+        )
+
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+
+        with patch("api.time.time", return_value=time.time() + 61):
+            assert breaker.allow()
+            assert not breaker.allow()
+            breaker.record_success()
+            assert breaker.allow()
+            assert breaker.allow()
+
+    def test_half_open_trial_lost(self):
+        breaker = CircuitBreaker(
+            threshold=1, reset_timeout=60, state={"failures": 1, "opened_at": time.time() - 61}
+        )
+
+        assert breaker.allow()
+        with patch("api.time.time", return_value=time.time() + 61):
+            assert breaker.allow()
+
+    def test_open(self):
+        breaker = CircuitBreaker(threshold=3)
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
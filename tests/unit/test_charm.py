@@ -3,8 +3,10 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import hashlib
 import json
 import os
+import time
 import unittest
 import unittest.mock
 import uuid
@@ -13,17 +15,28 @@ import ops
 import ops.testing
 from charms.maas_site_manager_k8s.v0 import enroll
 from ops.pebble import CheckInfo, CheckLevel, CheckStatus
+from requests.exceptions import RequestException
 
+from api import ApiError, AuthError, CircuitOpenError, SiteRemoval
 from charm import (
+    ENROLL_TOKEN_POOL_SIZE,
     MSM_CREDS_ID,
+    MSM_CREDS_SECRET,
+    MSM_ENROLL_TOKEN_POOL_SECRET,
     MSM_PEER_NAME,
+    MSM_PENDING_SITE_REMOVALS,
+    MSM_SITE_COUNT,
     PASSWD_CHOICES,
+    S3_CA_CHAIN_FILE,
+    SERVICE_RESTART_MARGIN,
     DatabaseNotReadyError,
     MsmOperatorCharm,
     S3IntegrationNotReadyError,
     TemporalNotConfiguredError,
     TemporalWorkerNotConfiguredError,
+    parse_endpoints,
 )
+from tuning import parse as parse_tuning
 
 
 class TestCharm(unittest.TestCase):
@@ -54,7 +67,9 @@ class TestCharm(unittest.TestCase):
                 "msm": {
                     "override": "replace",
                     "summary": "MAAS Site Manager",
-                    "command": "uvicorn --host 0.0.0.0 --port 8000 --factory --loop uvloop msm.apiserver.main:create_app",
+                    "command": "uvicorn --host 0.0.0.0 --port 8000 --factory --loop uvloop"
+                    " --backlog 4096 --timeout-keep-alive 75 --timeout-graceful-shutdown 30"
+                    " msm.apiserver.main:create_app",
                     "startup": "enabled",
                     "environment": {
                         "UVICORN_LOG_LEVEL": "info",
@@ -63,17 +78,39 @@ class TestCharm(unittest.TestCase):
                         "MSM_DB_USER": None,
                         "MSM_DB_NAME": None,
                         "MSM_DB_PASSWORD": None,
+                        "MSM_DB_HOSTS": None,
+                        "MSM_DB_TARGET_SESSION_ATTRS": None,
+                        "MSM_DB_RO_HOSTS": None,
+                        "MSM_DB_POOLER": None,
+                        "MSM_DB_STATEMENT_CACHE_SIZE": None,
                         "MSM_BASE_PATH": None,
                         "MSM_S3_ACCESS_KEY": None,
                         "MSM_S3_SECRET_KEY": None,
                         "MSM_S3_ENDPOINT": None,
                         "MSM_S3_BUCKET": None,
                         "MSM_S3_PATH": None,
+                        "MSM_S3_REGION": None,
+                        "MSM_S3_URI_STYLE": None,
+                        "MSM_S3_STORAGE_CLASS": None,
+                        "MSM_S3_API_VERSION": None,
+                        "MSM_S3_TLS_CA_FILE": None,
+                        "MSM_S3_TLS_CA_SHA256": None,
+                        "MSM_S3_MULTIPART_PART_SIZE_BYTES": str(64 * 1024 * 1024),
+                        "MSM_S3_MAX_CONCURRENCY": "8",
+                        "MSM_IMAGE_SERVING_MODE": "proxy",
+                        "MSM_IMAGE_CACHE_DIR": None,
+                        "MSM_IMAGE_CACHE_MAX_SIZE_BYTES": None,
+                        "MSM_IMAGE_CACHE_EVICTION_POLICY": None,
+                        "MSM_S3_PRESIGN_TTL_SEC": None,
                         "MSM_TEMPORAL_SERVER_ADDRESS": "temporal:7233",
                         "MSM_TEMPORAL_NAMESPACE": "msm-namespace",
                         "MSM_TEMPORAL_TASK_QUEUE": "msm-queue",
                         "MSM_TEMPORAL_TLS_ROOT_CAS": "",
+                        "MSM_DB_POOL_SIZE": "20",
+                        "MSM_DB_MAX_OVERFLOW": "70",
+                        "MSM_DB_POOL_TIMEOUT_SEC": "30",
                     },
+                    "kill-delay": "30s",
                 }
             },
             "checks": {
@@ -159,6 +196,8 @@ class TestCharm(unittest.TestCase):
             "endpoint": "test-endpoint",
             "bucket": "test-bucket",
             "path": "test-path",
+            "region": "eu-west-1",
+            "s3-uri-style": "path",
         }
         mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
         mock_version.return_value = "1.0.0"
@@ -190,10 +229,102 @@ class TestCharm(unittest.TestCase):
         self.assertEqual(updated_env["MSM_S3_ENDPOINT"], "test-endpoint")
         self.assertEqual(updated_env["MSM_S3_BUCKET"], "test-bucket")
         self.assertEqual(updated_env["MSM_S3_PATH"], "test-path")
+        self.assertEqual(updated_env["MSM_S3_REGION"], "eu-west-1")
+        self.assertEqual(updated_env["MSM_S3_URI_STYLE"], "path")
         self.assertEqual(updated_env["MSM_TEMPORAL_SERVER_ADDRESS"], "temporal:7233")
         self.assertEqual(updated_env["MSM_TEMPORAL_NAMESPACE"], "msm-namespace")
         self.assertEqual(updated_env["MSM_TEMPORAL_TASK_QUEUE"], "msm-queue")
 
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("ops.model.Container.get_check")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    def test_image_serving_mode(
+        self,
+        mock_fetch_postgres_relation_data,
+        mock_fetch_s3_connection_info,
+        mock_get_check,
+        mock_version,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_version.return_value = "1.0.0"
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.set_can_connect("site-manager", True)
+
+        self.harness.update_config()
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_IMAGE_SERVING_MODE"], "proxy")
+        self.assertIsNone(env["MSM_S3_PRESIGN_TTL_SEC"])
+
+        self.harness.update_config({"image-serving-mode": "redirect", "image-presign-ttl": 600})
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_IMAGE_SERVING_MODE"], "redirect")
+        self.assertEqual(env["MSM_S3_PRESIGN_TTL_SEC"], "600")
+
+        self.harness.update_config({"image-serving-mode": "p2p"})
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "Invalid configuration: image-serving-mode must be one of proxy, redirect,"
+                " got 'p2p'"
+            ),
+        )
+
+    def test_fetch_s3_connection_info(self):
+        self.harness.set_can_connect("site-manager", True)
+        self.harness.add_relation(
+            "s3",
+            "s3-integrator",
+            app_data={
+                "access-key": "test-access-key",
+                "secret-key": "test-secret-key",
+                "endpoint": "https://rgw.example.com",
+                "bucket": "msm-images",
+                "path": "images",
+                "region": "default",
+                "s3-uri-style": "path",
+                "storage-class": "STANDARD",
+                "s3-api-version": "4",
+                "tls-ca-chain": json.dumps(["-----BEGIN CERTIFICATE-----", "root"]),
+            },
+        )
+
+        s3_data = self.harness.charm._fetch_s3_connection_info()
+
+        self.assertEqual(s3_data["storage-class"], "STANDARD")
+        self.assertEqual(s3_data["s3-api-version"], "4")
+        self.harness.charm._push_s3_ca_chain()
+        container = self.harness.model.unit.get_container("site-manager")
+        self.assertEqual(
+            container.pull(S3_CA_CHAIN_FILE).read(), "-----BEGIN CERTIFICATE-----\nroot"
+        )
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    def test_s3_ca_chain_rotated(
+        self,
+        mock_fetch_s3_connection_info,
+        mock_fetch_postgres_relation_data,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        mock_fetch_s3_connection_info.return_value = {"tls-ca-chain": "old"}
+        env = self.harness.charm.app_environment
+        self.assertEqual(env["MSM_S3_TLS_CA_FILE"], S3_CA_CHAIN_FILE)
+
+        # the file path stays the same, the digest changes the layer
+        mock_fetch_s3_connection_info.return_value = {"tls-ca-chain": "new"}
+        rotated = self.harness.charm.app_environment
+        self.assertEqual(rotated["MSM_S3_TLS_CA_FILE"], S3_CA_CHAIN_FILE)
+        self.assertEqual(rotated["MSM_S3_TLS_CA_SHA256"], hashlib.sha256(b"new").hexdigest())
+        self.assertNotEqual(env["MSM_S3_TLS_CA_SHA256"], rotated["MSM_S3_TLS_CA_SHA256"])
+
     @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
     @unittest.mock.patch("ops.model.Container.get_check")
     @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
@@ -225,6 +356,418 @@ class TestCharm(unittest.TestCase):
             self.harness.model.unit.status, ops.WaitingStatus("Waiting for s3 integration")
         )
 
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_config_changed_restarts_only_on_change(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.set_can_connect("site-manager", True)
+        container = self.harness.model.unit.get_container("site-manager")
+
+        pebble = container.pebble
+
+        with (
+            unittest.mock.patch.object(
+                pebble, "restart_services", wraps=pebble.restart_services
+            ) as restart,
+            unittest.mock.patch.object(container, "replan", wraps=container.replan) as replan,
+        ):
+            self.harness.update_config({"log-level": "debug"})
+            self.harness.charm.on.config_changed.emit()
+            self.harness.update_config({"log-level": "info"})
+
+        self.assertEqual(restart.call_count, 2)
+        # the restart outlasts the kill-delay draining in-flight requests
+        restart.assert_called_with(["msm"], timeout=30 + SERVICE_RESTART_MARGIN)
+        replan.assert_called_once()
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_config_changed_restart_timeout(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.add_relation(MSM_PEER_NAME, self.harness.charm.app.name)
+        self.harness.set_can_connect("site-manager", True)
+        container = self.harness.model.unit.get_container("site-manager")
+
+        with unittest.mock.patch.object(
+            container.pebble,
+            "restart_services",
+            side_effect=ops.pebble.TimeoutError("timed out waiting for change"),
+        ) as restart:
+            self.harness.update_config({"graceful-timeout": 600})
+
+        restart.assert_called_once_with(["msm"], timeout=600 + SERVICE_RESTART_MARGIN)
+        # not recorded as applied, the next hook restarts the service again
+        self.assertFalse(
+            self.harness.charm.get_peer_data(self.harness.charm.unit, "applied-layer-hash")
+        )
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_reconcile_skips_applied_layer(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.add_relation(MSM_PEER_NAME, self.harness.charm.app.name)
+        container = self.harness.model.unit.get_container("site-manager")
+
+        with unittest.mock.patch.object(
+            container, "add_layer", wraps=container.add_layer
+        ) as add_layer:
+            self.harness.container_pebble_ready("site-manager")
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.config_changed.emit()
+
+        add_layer.assert_called_once()
+        self.assertTrue(
+            self.harness.charm.get_peer_data(self.harness.charm.unit, "applied-layer-hash")
+        )
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
+        # the layer is applied again if the service went away, e.g. pod churn
+        container.stop("msm")
+        self.harness.charm.on.config_changed.emit()
+        self.assertTrue(container.get_service("msm").is_running())
+
+    def test_workers(self):
+        self.harness.set_can_connect("site-manager", True)
+        container = self.harness.model.unit.get_container("site-manager")
+        self.assertEqual(self.harness.charm.workers, 1)
+
+        self.harness.update_config({"workers": "4"})
+        self.assertEqual(self.harness.charm.workers, 4)
+
+        self.harness.update_config({"workers": "auto"})
+        # no cgroup information available
+        self.assertEqual(self.harness.charm.workers, 1)
+        # cgroup v1
+        container.push("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "150000\n", make_dirs=True)
+        container.push("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "100000\n", make_dirs=True)
+        self.assertEqual(self.harness.charm.workers, 2)
+        # cgroup v2 takes precedence
+        container.push("/sys/fs/cgroup/cpu.max", "400000 100000\n", make_dirs=True)
+        self.assertEqual(self.harness.charm.workers, 4)
+        container.push("/sys/fs/cgroup/cpu.max", "max 100000\n", make_dirs=True)
+        self.assertEqual(self.harness.charm.workers, 1)
+
+        for value in ("0", "-2", "many"):
+            self.harness.update_config({"workers": value})
+            with self.assertRaises(ValueError):
+                self.harness.charm.workers
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_config_changed_workers(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.set_can_connect("site-manager", True)
+
+        self.harness.update_config({"workers": "3"})
+        plan = self.harness.get_container_pebble_plan("site-manager").to_dict()
+        self.assertIn("--workers 3", plan["services"]["msm"]["command"])
+
+        self.harness.update_config({"graceful-timeout": 120})
+        service = self.harness.get_container_pebble_plan("site-manager").services["msm"]
+        self.assertEqual(service.kill_delay, "120s")
+        self.assertIn("--timeout-graceful-shutdown 120", service.command)
+
+        self.harness.update_config({"workers": "none"})
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+
+    def test_uvicorn_command(self):
+        self.harness.update_config(
+            {
+                "backlog": 1024,
+                "limit-concurrency": 2000,
+                "timeout-keep-alive": 30,
+                "http": "h11",
+                "h11-max-incomplete-event-size": 32768,
+                "limit-max-requests": 10000,
+            }
+        )
+        self.assertEqual(
+            " ".join(self.harness.charm._uvicorn_command()),
+            "uvicorn --host 0.0.0.0 --port 8000 --factory --loop uvloop --backlog 1024"
+            " --timeout-keep-alive 30 --timeout-graceful-shutdown 30 --limit-concurrency 2000"
+            " --http h11 --h11-max-incomplete-event-size 32768 msm.apiserver.main:create_app",
+        )
+
+        # processes are only recycled by the supervisor of multiple workers
+        self.harness.update_config({"workers": "2"})
+        self.assertIn(
+            "--workers 2 --limit-max-requests 10000",
+            " ".join(self.harness.charm._uvicorn_command()),
+        )
+        self.harness.update_config(unset=["workers"])
+
+        for option, value in (("backlog", 0), ("limit-concurrency", -1), ("http", "h2")):
+            with self.subTest(option=option):
+                self.harness.update_config({option: value})
+                with self.assertRaises(ValueError):
+                    self.harness.charm._uvicorn_command()
+                self.harness.update_config(unset=[option])
+
+    def test_gunicorn_command(self):
+        self.harness.update_config(
+            {
+                "server": "gunicorn",
+                "workers": "2",
+                "max-requests": 1000,
+                "max-requests-jitter": 50,
+                "preload": True,
+            }
+        )
+        self.assertEqual(
+            " ".join(self.harness.charm._gunicorn_command()),
+            "gunicorn --bind 0.0.0.0:8000 --worker-class uvicorn.workers.UvicornWorker"
+            " --workers 2 --backlog 4096 --keep-alive 75 --graceful-timeout 30 --max-requests 1000 --max-requests-jitter 50"
+            " --preload 'msm.apiserver.main:create_app()'",
+        )
+
+        self.harness.update_config({"server": "hypercorn"})
+        with self.assertRaises(ValueError):
+            self.harness.charm.server
+
+    @unittest.mock.patch(
+        "charm.MsmOperatorCharm.root_path", new_callable=unittest.mock.PropertyMock
+    )
+    def test_gunicorn_root_path(self, mock_root_path):
+        mock_root_path.return_value = "/msm"
+        self.harness.set_can_connect("site-manager", True)
+        self.harness.update_config({"server": "gunicorn"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "Invalid configuration: server 'gunicorn' cannot serve the ingress path prefix"
+                " /msm, use server 'uvicorn'"
+            ),
+        )
+
+    @unittest.mock.patch("charm.parse_tuning", wraps=parse_tuning)
+    def test_tuning_cached(self, mock_parse):
+        self.harness.update_config(
+            {"environment": "- {name: MSM_HEARTBEAT_INTERVAL_SEC, value: 60}"}
+        )
+        self.assertEqual(self.harness.charm.tuning.environment, {"MSM_HEARTBEAT_INTERVAL_SEC": 60})
+        self.harness.charm.tuning
+        mock_parse.assert_called_once()
+
+        self.harness.update_config({"backlog": 512})
+        self.assertEqual(self.harness.charm.tuning.options["backlog"], 512)
+        self.assertEqual(mock_parse.call_count, 2)
+
+        # settings cached by an older charm revision are parsed again
+        with unittest.mock.patch("tuning.SCHEMA_VERSION", 0):
+            self.harness.charm.tuning
+        self.assertEqual(mock_parse.call_count, 3)
+
+    def test_config_changed_invalid_tuning(self):
+        self.harness.set_can_connect("site-manager", True)
+        self.harness.update_config(
+            {"environment": "- {name: MSM_METRICS_REFRESH_INTERVAL_SEC, value: 0}"}
+        )
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "Invalid configuration: MSM_METRICS_REFRESH_INTERVAL_SEC must be between"
+                " 10 and 86400 seconds, got 0"
+            ),
+        )
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._ensure_operator_user", return_value=True)
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_adaptive_heartbeat(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+        mock_client,
+        mock_ensure_operator_user,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        mock_client.return_value.count_sites.return_value = 5000
+        self.harness.set_leader(True)
+        self.harness.set_can_connect("site-manager", True)
+        self.harness.add_relation(MSM_PEER_NAME, self.harness.charm.app.name)
+
+        self.harness.update_config({"heartbeat-mode": "adaptive"})
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_HEARTBEAT_INTERVAL_SEC"], "300")
+        self.assertEqual(env["MSM_CONN_LOST_THRESHOLD_SEC"], "600")
+
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.charm.get_peer_data(self.harness.charm.app, "site-count"), 5000
+        )
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_HEARTBEAT_INTERVAL_SEC"], "600")
+        self.assertEqual(env["MSM_CONN_LOST_THRESHOLD_SEC"], "1200")
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._reconcile")
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_update_status_site_count(self, mock_client, mock_reconcile):
+        client = mock_client.return_value
+        client.count_sites.return_value = 0
+        self.harness.set_leader(True)
+        self.harness.add_relation(MSM_PEER_NAME, self.harness.charm.app.name)
+        self.harness.update_config({"heartbeat-mode": "Adaptive"})
+        mock_reconcile.reset_mock()
+
+        # an unchanged empty fleet does not reconcile the workload
+        self.harness.charm.on.update_status.emit()
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(client.count_sites.call_count, 2)
+        mock_reconcile.assert_not_called()
+
+        client.count_sites.side_effect = AuthError("denied")
+        self.harness.charm.on.update_status.emit()
+        mock_reconcile.assert_not_called()
+
+        # a shrinking fleet lowers the stored count
+        self.harness.charm.set_peer_data(self.harness.charm.app, MSM_SITE_COUNT, 1000)
+        client.count_sites.side_effect = None
+        client.count_sites.return_value = 5
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.charm.get_peer_data(self.harness.charm.app, MSM_SITE_COUNT), 5
+        )
+        mock_reconcile.assert_called_once()
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_db_pool_scales_with_units(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.set_can_connect("site-manager", True)
+        self.harness.update_config({"workers": "2", "db-max-connections": 200})
+        rel_id = self.harness.add_relation(MSM_PEER_NAME, self.harness.charm.app.name)
+
+        self.harness.set_planned_units(3)
+        self.harness.add_relation_unit(rel_id, f"{self.harness.charm.app.name}/1")
+
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        # 190 connections shared by 6 processes
+        self.assertEqual(env["MSM_DB_POOL_SIZE"], "15")
+        self.assertEqual(env["MSM_DB_MAX_OVERFLOW"], "16")
+
+        self.harness.update_config({"db-max-connections": 15})
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "Invalid configuration: db-max-connections (15) is too low for 6 server processes"
+            ),
+        )
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_postgres_relation_data")
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_image_cache_storage(
+        self,
+        mock_get_check,
+        mock_fetch_postgres_relation_data,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_postgres_relation_data.return_value = {}
+        mock_version.return_value = "1.0.0"
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.set_can_connect("site-manager", True)
+        self.harness.update_config(
+            {"image-cache-max-size": 2048, "image-cache-eviction-policy": "lfu"}
+        )
+
+        (storage_id,) = self.harness.add_storage("image-cache", attach=True)
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_IMAGE_CACHE_DIR"], "/var/cache/msm/images")
+        self.assertEqual(env["MSM_IMAGE_CACHE_MAX_SIZE_BYTES"], str(2048 * 1024 * 1024))
+        self.assertEqual(env["MSM_IMAGE_CACHE_EVICTION_POLICY"], "lfu")
+
+        self.harness.detach_storage(storage_id)
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertIsNone(env["MSM_IMAGE_CACHE_DIR"])
+
     def test_config_changed_valid_cannot_connect(self):
         # Trigger a config-changed event with an updated value
         self.harness.update_config({"log-level": "debug"})
@@ -256,6 +799,130 @@ class TestCharm(unittest.TestCase):
             self.harness.model.unit.status, ops.WaitingStatus("Waiting for database relation")
         )
 
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_database_read_replicas(
+        self,
+        mock_get_check,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_version.return_value = "1.0.0"
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.container_pebble_ready("site-manager")
+        self.harness.add_relation(
+            "database",
+            "postgresql",
+            app_data={
+                "endpoints": "postgresql-0.localhost:5432",
+                "read-only-endpoints": "postgresql-1.localhost:5432,postgresql-2.localhost:5432",
+                "username": "appuser",
+                "password": "secret",
+                "database": "name",
+            },
+        )
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertIsNone(env["MSM_DB_RO_HOSTS"])
+
+        self.harness.update_config({"db-read-replicas": True})
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(
+            env["MSM_DB_RO_HOSTS"], "postgresql-1.localhost:5432,postgresql-2.localhost:5432"
+        )
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_database_pgbouncer(
+        self,
+        mock_get_check,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_version.return_value = "1.0.0"
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.container_pebble_ready("site-manager")
+        self.harness.add_relation(
+            "database",
+            "msm-pgbouncer",
+            app_data={
+                "endpoints": "msm-pgbouncer.localhost:6432",
+                "username": "appuser",
+                "password": "secret",
+                "database": "name",
+            },
+        )
+        # the application name is not taken as a hint
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertIsNone(env["MSM_DB_POOLER"])
+        self.assertIsNone(env["MSM_DB_STATEMENT_CACHE_SIZE"])
+
+        self.harness.update_config({"db-pooler": "pgbouncer"})
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_DB_POOLER"], "pgbouncer")
+        self.assertEqual(env["MSM_DB_STATEMENT_CACHE_SIZE"], "0")
+
+        for pooler in ("auto", "pgpool"):
+            with self.subTest(pooler=pooler):
+                self.harness.update_config({"db-pooler": pooler})
+                self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+
+    def test_parse_endpoints(self):
+        self.assertEqual(
+            parse_endpoints("pg-0:5432,pg-1:5433, [fd00::1]:5432,fd00::2,pg-2"),
+            [
+                ("pg-0", "5432"),
+                ("pg-1", "5433"),
+                ("fd00::1", "5432"),
+                ("fd00::2", "5432"),
+                ("pg-2", "5432"),
+            ],
+        )
+        self.assertEqual(parse_endpoints(""), [])
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
+    @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
+    @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
+    @unittest.mock.patch("ops.model.Container.get_check")
+    def test_database_multiple_endpoints(
+        self,
+        mock_get_check,
+        mock_version,
+        mock_fetch_s3_connection_info,
+        mock_fetch_temporal_relation_data,
+    ):
+        mock_version.return_value = "1.0.0"
+        mock_get_check.return_value = CheckInfo("http-test", CheckLevel.ALIVE, CheckStatus.UP)
+        mock_fetch_s3_connection_info.return_value = {}
+        mock_fetch_temporal_relation_data.return_value = {}
+        self.harness.container_pebble_ready("site-manager")
+        self.harness.add_relation(
+            "database",
+            "postgresql",
+            app_data={
+                "endpoints": "[fd00::10]:5432,[fd00::11]:5432",
+                "username": "appuser",
+                "password": "secret",
+                "database": "name",
+            },
+        )
+        env = self.harness.get_container_pebble_plan("site-manager").services["msm"].environment
+        self.assertEqual(env["MSM_DB_HOST"], "fd00::10")
+        self.assertEqual(env["MSM_DB_PORT"], "5432")
+        self.assertEqual(env["MSM_DB_HOSTS"], "[fd00::10]:5432,[fd00::11]:5432")
+        self.assertEqual(env["MSM_DB_TARGET_SESSION_ATTRS"], "read-write")
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
     @unittest.mock.patch("charm.MsmOperatorCharm._fetch_temporal_relation_data")
     @unittest.mock.patch("charm.MsmOperatorCharm._fetch_s3_connection_info")
     @unittest.mock.patch("charm.MsmOperatorCharm.version", new_callable=unittest.mock.PropertyMock)
@@ -602,6 +1269,16 @@ class TestCharmActions(unittest.TestCase):
                 },
             )
 
+    def test_get_api_stats_action(self):
+        self.harness.charm._api_stats.record("GET /api/v1/sites", 0.02, 200, 100)
+
+        output = self.harness.run_action("get-api-stats", {"reset": True})
+
+        stats = json.loads(output.results["stats"])
+        self.assertEqual(stats["GET /api/v1/sites"]["count"], 1)
+        self.assertEqual(stats["GET /api/v1/sites"]["bytes"], 100)
+        self.assertEqual(self.harness.charm._api_stats.data, {})
+
     def test_create_admin_action_not_ready(self):
         def create_admin_handler(args: ops.testing.ExecArgs) -> ops.testing.ExecResult:
             return ops.testing.ExecResult(exit_code=0)
@@ -727,6 +1404,175 @@ class TestEnrollment(unittest.TestCase):
         secret = self.harness.model.get_secret(id=data["token_id"]).get_content()
         self.assertEqual(secret["enroll-token"], "my-token")
 
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_enroll_token")
+    def test_enroll_circuit_open(self, mock_enroll):
+        mock_enroll.side_effect = CircuitOpenError("open")
+        self.harness.set_leader(True)
+        self.harness.begin()
+        rel_id = self.harness.add_relation(
+            enroll.DEFAULT_ENDPOINT_NAME,
+            "maas-region",
+            unit_data={"unit": "maas-region/0", "uuid": self.maas_id},
+        )
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app)
+        self.assertNotIn("token_id", data)  # codespell:ignore
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_broken(self, mock_client):
+        client = mock_client.return_value
+        client.remove_sites.return_value = {
+            "failed-earlier": SiteRemoval.REMOVED,
+            self.maas_id: SiteRemoval.FAILED,
+        }
+        self.harness.set_leader(True)
+        self.harness.begin()
+        app = self.harness.charm.app
+        peer_id = self.harness.add_relation(MSM_PEER_NAME, app.name)
+        self.harness.update_relation_data(
+            peer_id, app.name, {MSM_PENDING_SITE_REMOVALS: '["failed-earlier"]'}
+        )
+        rel_id = self.harness.add_relation(
+            enroll.DEFAULT_ENDPOINT_NAME, "maas-region", app_data={"uuid": self.maas_id}
+        )
+
+        self.harness.remove_relation(rel_id)
+
+        client.remove_sites.assert_called_once_with(["failed-earlier", self.maas_id])
+        self.assertEqual(
+            self.harness.charm.get_peer_data(app, MSM_PENDING_SITE_REMOVALS), [self.maas_id]
+        )
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_broken_circuit_open(self, mock_client):
+        client = mock_client.return_value
+        client.remove_sites.side_effect = CircuitOpenError("open")
+        self.harness.set_leader(True)
+        self.harness.begin()
+        app = self.harness.charm.app
+        self.harness.add_relation(MSM_PEER_NAME, app.name)
+        rel_id = self.harness.add_relation(
+            enroll.DEFAULT_ENDPOINT_NAME, "maas-region", app_data={"uuid": self.maas_id}
+        )
+
+        self.harness.remove_relation(rel_id)
+        self.assertEqual(
+            self.harness.charm.get_peer_data(app, MSM_PENDING_SITE_REMOVALS), [self.maas_id]
+        )
+
+        # pending removals are retried on update-status
+        client.remove_sites.side_effect = None
+        client.remove_sites.return_value = {self.maas_id: SiteRemoval.REMOVED}
+        self.harness.charm.on.update_status.emit()
+
+        client.remove_sites.assert_called_with([self.maas_id])
+        self.assertEqual(self.harness.charm.get_peer_data(app, MSM_PENDING_SITE_REMOVALS), {})
+
+    def add_enroll_relations(self, count: int) -> list[ops.Relation]:
+        return [
+            self.harness.model.get_relation(
+                enroll.DEFAULT_ENDPOINT_NAME,
+                self.harness.add_relation(enroll.DEFAULT_ENDPOINT_NAME, f"maas-region-{i}"),
+            )
+            for i in range(count)
+        ]
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_token_pool(self, mock_client):
+        expiry = time.time() + 3600
+        client = mock_client.return_value
+        client.issue_enroll_tokens.return_value = [(f"token-{i}", expiry) for i in range(3)]
+        self.harness.set_leader(True)
+        self.harness.begin()
+        relations = self.add_enroll_relations(3)
+
+        for i, relation in enumerate(relations[:2]):
+            token = self.harness.charm._get_enroll_token()
+            self.assertEqual(token, f"token-{i}")
+            self.harness.charm._enroll.publish_enroll_token(relation, token)
+
+        # the refill is sized to the relations waiting for a token
+        client.issue_enroll_tokens.assert_called_once_with(3)
+        secret = self.harness.model.get_secret(label=MSM_ENROLL_TOKEN_POOL_SECRET)
+        tokens = json.loads(secret.get_content(refresh=True)["tokens"])
+        self.assertEqual(len(tokens), 1)
+
+        secret_id = secret.get_info().id
+        self.harness.trigger_secret_removal(secret_id, 1, label=MSM_ENROLL_TOKEN_POOL_SECRET)
+        self.assertEqual(self.harness.get_secret_revisions(secret_id), [2])
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_token_pool_capped(self, mock_client):
+        client = mock_client.return_value
+        client.issue_enroll_tokens.return_value = [("token", time.time() + 3600)]
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.add_enroll_relations(ENROLL_TOKEN_POOL_SIZE + 5)
+
+        self.harness.charm._get_enroll_token()
+
+        client.issue_enroll_tokens.assert_called_once_with(ENROLL_TOKEN_POOL_SIZE)
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_token_pool_idle(self, mock_client):
+        client = mock_client.return_value
+        client.issue_enroll_tokens.return_value = [("fresh", time.time() + 3600)]
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.harness.charm.app.add_secret(
+            {"tokens": json.dumps([("expired", time.time() + 60)])},
+            label=MSM_ENROLL_TOKEN_POOL_SECRET,
+        )
+
+        self.assertEqual(self.harness.charm._get_enroll_token(), "fresh")
+
+        client.issue_enroll_tokens.assert_called_once_with(1)
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_token_pool_refill(self, mock_client):
+        now = time.time()
+        client = mock_client.return_value
+        client.issue_enroll_tokens.return_value = [("fresh", now + 3600)] * 7
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.add_enroll_relations(10)
+        pooled = [("expiring", now + 60)] + [(f"token-{i}", now + 3600) for i in range(3)]
+        self.harness.charm.app.add_secret(
+            {"tokens": json.dumps(pooled)}, label=MSM_ENROLL_TOKEN_POOL_SECRET
+        )
+
+        self.assertEqual(self.harness.charm._get_enroll_token(), "token-0")
+
+        client.issue_enroll_tokens.assert_called_once_with(10 - 3)
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_token_pool_refill_failed(self, mock_client):
+        now = time.time()
+        client = mock_client.return_value
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.add_enroll_relations(10)
+        pooled = [(f"token-{i}", now + 3600) for i in range(3)]
+        self.harness.charm.app.add_secret(
+            {"tokens": json.dumps(pooled)}, label=MSM_ENROLL_TOKEN_POOL_SECRET
+        )
+
+        for error in (CircuitOpenError("open"), ApiError("failed"), RequestException()):
+            with self.subTest(error=error):
+                client.issue_enroll_tokens.side_effect = error
+                self.assertEqual(self.harness.charm._get_enroll_token(), pooled.pop(0)[0])
+
+        # nothing left to fall back to
+        with self.assertRaises(RequestException):
+            self.harness.charm._get_enroll_token()
+
+    @unittest.mock.patch("charm.MsmOperatorCharm._get_site_manager_client")
+    def test_enroll_token_pool_unavailable(self, mock_client):
+        mock_client.return_value = None
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+        self.assertIsNone(self.harness.charm._get_enroll_token())
+
 
 class TestHelperMethods(unittest.TestCase):
     """Test the helper methods added to reduce code duplication."""
@@ -847,8 +1693,65 @@ class TestHelperMethods(unittest.TestCase):
 
         self.assertIsNotNone(client)
         mock_client_class.assert_called_once_with(
-            username="test@example.com", password="testpass", url="http://localhost:8000"
+            username="test@example.com",
+            password="testpass",
+            url="http://localhost:8000",
+            access_token=None,
+            on_login=unittest.mock.ANY,
+            deadline=unittest.mock.ANY,
+            circuit_breaker=unittest.mock.ANY,
+            stats=unittest.mock.ANY,
+            cache=unittest.mock.ANY,
+        )
+
+    def test_get_site_manager_client_cached_token(self):
+        """Test _get_site_manager_client reuses and stores the cached access token."""
+        self.harness.set_leader(True)
+        app = self.harness.charm.app
+        rel_id = self.harness.add_relation(MSM_PEER_NAME, app.name)
+        secret = app.add_secret(
+            {"username": "test@example.com", "password": "testpass", "access-token": "old"},
+            label="test-secret",
+        )
+        secret_id = secret.get_info().id
+        self.harness.update_relation_data(rel_id, app.name, {MSM_CREDS_ID: f'"{secret_id}"'})
+
+        client = self.harness.charm._get_site_manager_client()
+        self.assertEqual(client.access_token, "old")
+
+        client._on_login("new")
+
+        content = self.harness.model.get_secret(id=secret_id).get_content(refresh=True)
+        self.assertEqual(content["access-token"], "new")
+        self.assertEqual(content["password"], "testpass")
+
+    def test_save_access_token_unchanged(self):
+        """Test _save_access_token only creates a revision when the token changes."""
+        self.harness.set_leader(True)
+        secret = self.harness.charm.app.add_secret(
+            {"username": "test@example.com", "password": "testpass", "access-token": "old"},
+            label=MSM_CREDS_SECRET,
         )
+        secret_id = secret.get_info().id
+
+        self.harness.charm._save_access_token(secret, "old")
+        self.assertEqual(self.harness.get_secret_revisions(secret_id), [1])
+
+        self.harness.charm._save_access_token(secret, "new")
+        self.assertEqual(self.harness.get_secret_revisions(secret_id), [1, 2])
+
+    def test_secret_remove(self):
+        """Test unused revisions of the credentials secret are removed."""
+        self.harness.set_leader(True)
+        secret = self.harness.charm.app.add_secret(
+            {"username": "test@example.com", "password": "testpass"}, label=MSM_CREDS_SECRET
+        )
+        secret_id = secret.get_info().id
+        self.harness.charm._save_access_token(secret, "new")
+
+        self.harness.trigger_secret_removal(secret_id, 1, label=MSM_CREDS_SECRET)
+
+        self.assertEqual(self.harness.get_secret_revisions(secret_id), [2])
 
     def test_update_ca_certificates(self):
         """Test _update_ca_certificates executes the correct command."""
@@ -0,0 +1,169 @@
+import unittest
+import unittest.mock
+
+from tuning import (
+    OPTION_SETTINGS,
+    Setting,
+    Tuning,
+    TuningError,
+    config_hash,
+    db_pool,
+    parse,
+    parse_environment,
+)
+
+CONFIG = {
+    "workers": "1",
+    "environment": "",
+    "backlog": 4096,
+    "limit-concurrency": 0,
+    "timeout-keep-alive": 75,
+    "h11-max-incomplete-event-size": 16384,
+    "limit-max-requests": 0,
+    "max-requests": 0,
+    "max-requests-jitter": 0,
+    "graceful-timeout": 30,
+    "heartbeat-mode": "static",
+    "heartbeat-rate-budget": 10,
+    "db-max-connections": 100,
+    "image-presign-ttl": 3600,
+    "image-cache-max-size": 10240,
+    "image-cache-eviction-policy": "lru",
+    "s3-multipart-part-size": 64,
+    "s3-max-concurrency": 8,
+}
+
+
+class TestSetting(unittest.TestCase):
+    def test_validate(self):
+        setting = Setting("MSM_TEST_SEC", 10, 60, "seconds")
+        assert setting.validate(10) == 10
+        assert setting.validate("60") == 60
+
+    def test_validate_invalid(self):
+        setting = Setting("MSM_TEST_SEC", 10, 60, "seconds")
+        for value, message in (
+            (5, "MSM_TEST_SEC must be between 10 and 60 seconds, got 5"),
+            (61, "MSM_TEST_SEC must be between 10 and 60 seconds, got 61"),
+            ("ten", "MSM_TEST_SEC must be an integer, got 'ten'"),
+            (True, "MSM_TEST_SEC must be an integer, got 'True'"),
+            (1.5, "MSM_TEST_SEC must be an integer, got '1.5'"),
+        ):
+            with self.subTest(value=value):
+                with self.assertRaisesRegex(TuningError, message):
+                    setting.validate(value)
+
+
+class TestParse(unittest.TestCase):
+    def test_parse_environment(self):
+        raw = """
+        - name: MSM_HEARTBEAT_INTERVAL_SEC
+          value: 60
+        - name: MSM_IMAGE_SERVING_CHUNK_SIZE_BYTES
+          value: "1048576"
+        """
+        assert parse_environment(raw) == {
+            "MSM_HEARTBEAT_INTERVAL_SEC": 60,
+            "MSM_IMAGE_SERVING_CHUNK_SIZE_BYTES": 1048576,
+        }
+        assert parse_environment("") == {}
+        assert parse_environment("[]") == {}
+
+    def test_parse_environment_invalid(self):
+        for raw, message in (
+            ("name: MSM_HEARTBEAT_INTERVAL_SEC", "must be in YAML format as a list"),
+            ("[{", "Failed to parse environment configuration"),
+            ("- name: MSM_HEARTBEAT_INTERVAL_SEC", "must have a name and a value"),
+            ("- {name: MSM_UNKNOWN, value: 1}", "Invalid environment variable: MSM_UNKNOWN"),
+            (
+                "- {name: MSM_HEARTBEAT_INTERVAL_SEC, value: 1}",
+                "MSM_HEARTBEAT_INTERVAL_SEC must be between 10 and 86400 seconds, got 1",
+            ),
+            (
+                "- {name: MSM_HEARTBEAT_INTERVAL_SEC, value: 900}",
+                "MSM_CONN_LOST_THRESHOLD_SEC must be greater than MSM_HEARTBEAT_INTERVAL_SEC",
+            ),
+        ):
+            with self.subTest(raw=raw):
+                with self.assertRaisesRegex(TuningError, message):
+                    parse_environment(raw)
+
+    def test_parse(self):
+        tuning = parse({**CONFIG, "workers": "auto"})
+
+        assert tuning.workers is None
+        assert tuning.options == {name: CONFIG[name] for name in OPTION_SETTINGS}
+        assert Tuning.from_dict(tuning.to_dict()) == tuning
+        assert parse(CONFIG).workers == 1
+
+    def test_parse_invalid_option(self):
+        with self.assertRaisesRegex(TuningError, "backlog must be between 1 and 65535"):
+            parse({**CONFIG, "backlog": 0})
+        with self.assertRaisesRegex(TuningError, "workers must be between 1 and 256"):
+            parse({**CONFIG, "workers": "0"})
+
+    def test_parse_invalid_heartbeat_mode(self):
+        with self.assertRaisesRegex(TuningError, "heartbeat-mode must be one of"):
+            parse({**CONFIG, "heartbeat-mode": "dynamic"})
+
+    def test_parse_invalid_eviction_policy(self):
+        with self.assertRaisesRegex(TuningError, "image-cache-eviction-policy must be one of"):
+            parse({**CONFIG, "image-cache-eviction-policy": "random"})
+
+    def test_config_hash(self):
+        assert config_hash(CONFIG) == config_hash(dict(reversed(CONFIG.items())))
+        assert config_hash(CONFIG) != config_hash({**CONFIG, "backlog": 1})
+        digest = config_hash(CONFIG)
+        with unittest.mock.patch("tuning.SCHEMA_VERSION", 0):
+            assert config_hash(CONFIG) != digest
+
+
+class TestHeartbeat(unittest.TestCase):
+    def test_static(self):
+        tuning = parse(CONFIG)
+        assert tuning.heartbeat(100_000) == (300, 600)
+
+    def test_adaptive(self):
+        tuning = parse({**CONFIG, "heartbeat-mode": "adaptive"})
+        # 10 requests per second at 300s covers 3000 sites
+        assert tuning.heartbeat(0) == (300, 600)
+        assert tuning.heartbeat(3000) == (300, 600)
+        assert tuning.heartbeat(3001) == (600, 1200)
+        assert tuning.heartbeat(5000) == (600, 1200)
+        assert tuning.heartbeat(20_000) == (2400, 4800)
+
+    def test_adaptive_custom_base(self):
+        environment = """
+        - {name: MSM_HEARTBEAT_INTERVAL_SEC, value: 60}
+        - {name: MSM_CONN_LOST_THRESHOLD_SEC, value: 150}
+        """
+        tuning = parse(
+            {
+                **CONFIG,
+                "heartbeat-mode": "adaptive",
+                "heartbeat-rate-budget": 1,
+                "environment": environment,
+            }
+        )
+        assert tuning.heartbeat(100) == (120, 300)
+
+    def test_adaptive_capped(self):
+        tuning = parse({**CONFIG, "heartbeat-mode": "adaptive", "heartbeat-rate-budget": 1})
+        # the threshold may not exceed its own maximum
+        assert tuning.heartbeat(10_000_000) == (38400, 76800)
+
+
+class TestDbPool(unittest.TestCase):
+    def test_single_process(self):
+        assert db_pool(100, 1) == {"size": 20, "max_overflow": 70, "timeout": 30}
+
+    def test_shared(self):
+        # 4 workers on 3 units share 90 connections
+        pool = db_pool(100, 12)
+        assert pool == {"size": 3, "max_overflow": 4, "timeout": 30}
+        assert (pool["size"] + pool["max_overflow"]) * 12 <= 90
+        assert db_pool(12, 2) == {"size": 1, "max_overflow": 0, "timeout": 30}
+
+    def test_too_many_processes(self):
+        with self.assertRaisesRegex(TuningError, "too low for 100 server processes"):
+            db_pool(100, 100)